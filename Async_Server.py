@@ -0,0 +1,205 @@
+import asyncio
+import signal
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from HTTP_reader import RequestBody, RequestError, RECV_SIZE, CONTINUE, body_framing
+from HTTP_response import FileBody
+from HTTP_mmap import MappedBody
+from HTTP_metrics import PHASE_SEND
+
+# seconds a rejected client is given to finish sending its request before it is closed
+REJECT_DRAIN_TIMEOUT = 1
+
+#bridges the blocking RequestBody reads made from handler threads onto the event loop's stream
+class StreamBridge:
+	def __init__(self, reader, writer, loop, timeout, max_body_size):
+		self.reader = reader
+		self.writer = writer
+		self.loop = loop
+		self.timeout = timeout
+		self.max_body_size = max_body_size
+
+	def run(self, coro):
+		future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(coro, self.timeout), self.loop)
+		try:
+			return future.result()
+		except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+			raise ConnectionError('Connection lost mid-body')
+
+	def read_some(self, size):
+		return self.run(self.reader.read(min(size, RECV_SIZE)))
+
+	async def write_continue(self):
+		self.writer.write(CONTINUE)
+		await self.writer.drain()
+
+	def send_continue(self):
+		self.run(self.write_continue())
+
+	def readline(self, limit = 8192):
+		try:
+			return self.run(self.reader.readuntil(b'\r\n'))[ : -2]
+		except asyncio.LimitOverrunError:
+			raise RequestError(400, 'Line too long')
+
+
+#event-loop server mode: one coroutine per connection instead of one thread, while the
+#HTTP handlers (and their blocking file I/O) run on a bounded executor
+class AsyncServer:
+	def __init__(self, server):
+		self.server = server
+		self.loop = None
+		self.executor = ThreadPoolExecutor(max_workers = server.state.max_active_connections)
+		self.connections = set() # tasks serving admitted connections, waited for on shutdown
+
+	async def send(self, writer, response, message):
+		parts = message if isinstance(message, list) else [message]
+		writer.write(response)
+		try:
+			for part in parts:
+				if isinstance(part, FileBody):
+					# loop.sendfile uses os.sendfile on the transport's socket, or reads the file in chunks
+					await writer.drain()
+					try:
+						if part.count:
+							await self.loop.sendfile(writer.transport, part.file, part.offset, part.count)
+					finally:
+						part.close()
+				elif isinstance(part, MappedBody):
+					writer.write(part.view)
+				elif part:
+					writer.write(part)
+			await writer.drain()
+		finally:
+			# a view the transport still buffers keeps the mapping alive past its release
+			for part in parts:
+				if isinstance(part, MappedBody):
+					part.close()
+
+	async def discard(self, reader):
+		while await reader.read(RECV_SIZE):
+			pass
+
+	async def handle_client(self, reader, writer):
+		server = self.server
+		state = server.state
+		addr = writer.get_extra_info('peername')
+		served = 0
+		server.metrics.inc('http_connections_accepted_total')
+		# admission: beyond the worker pool plus its queue depth clients get a fast 503
+		if server.active_conn >= state.max_active_connections + state.queue_depth:
+			server.metrics.inc('http_connections_rejected_total')
+			response, message, keep_alive = server.handle_error(503, addr, {'Retry-After': state.retry_after})
+			try:
+				await self.send(writer, response, message)
+				# reading off the request so closing doesn't reset the connection and discard the 503
+				writer.write_eof()
+				await asyncio.wait_for(self.discard(reader), REJECT_DRAIN_TIMEOUT)
+			except (ConnectionError, asyncio.TimeoutError):
+				pass
+			writer.close()
+			return
+
+		# the count lives on the server (only touched from the loop here) for its metrics
+		server.active_conn += 1
+		task = asyncio.current_task()
+		self.connections.add(task)
+		try:
+			server.tune_socket(writer.get_extra_info('socket'), state)
+			while served < state.max_keep_alive_requests and not server.stopping:
+				try:
+					head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), state.keep_alive_timeout)
+				except asyncio.LimitOverrunError:
+					raise RequestError(431, 'Request header fields too large')
+				except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+					break
+
+				# clients may send stray CRLFs between pipelined requests
+				head = head.lstrip(b'\r\n')
+				if not head:
+					continue
+				served += 1
+
+				body = None
+				length, chunked, expect_continue = body_framing(head, state.max_body_size)
+				if chunked or length is not None:
+					bridge = StreamBridge(reader, writer, self.loop, state.keep_alive_timeout, state.max_body_size)
+					body = RequestBody(bridge, length, chunked, expect_continue)
+
+				args = (head, addr, served < state.max_keep_alive_requests and not server.stopping, body)
+				trace = server.profiler.begin(head) if server.profiler.enabled else None
+				if trace is None:
+					response, message, keep_alive = await self.loop.run_in_executor(self.executor, server.handle_request, *args)
+				else:
+					response, message, keep_alive = await self.loop.run_in_executor(
+						self.executor, server.profiler.call, trace, server.handle_request, *args)
+				started = time.perf_counter()
+				await self.send(writer, response, message)
+				sent = time.perf_counter() - started
+				server.metrics.observe('http_phase_seconds', PHASE_SEND, sent)
+				if trace is not None:
+					server.profiler.end(trace, sent)
+
+				# whatever the handler left of the body has to be consumed before the next request.
+				# A body found malformed now can't be answered any more, the response is out
+				try:
+					if body is not None and not await self.loop.run_in_executor(self.executor, body.drain):
+						break
+				except RequestError:
+					break
+				if not keep_alive:
+					break
+
+		except RequestError as e:
+			response, message, keep_alive = server.handle_error(e.status_code, addr)
+			try:
+				await self.send(writer, response, message)
+			except ConnectionError:
+				pass
+		except ConnectionError:
+			pass
+		except asyncio.CancelledError:
+			pass # cut off at the end of a graceful shutdown; ends the task like a dropped client
+		finally:
+			server.active_conn -= 1
+			self.connections.discard(task)
+			writer.close()
+
+	# stops accepting; connections in flight finish their current request
+	def stop(self, listener):
+		self.server.stopping = True
+		listener.close()
+
+	async def serve(self):
+		self.loop = asyncio.get_running_loop()
+		server = await asyncio.start_server(self.handle_client, self.server.host, self.server.port,
+			limit = self.server.state.max_header_size, backlog = self.server.state.listen_backlog, reuse_address = True, reuse_port = hasattr(socket, 'SO_REUSEPORT'))
+		print(f'Listening at: {server.sockets[0].getsockname()} (asyncio)')
+		try:
+			# SIGTERM stops accepting; in-flight handlers finish before the executor shuts down
+			self.loop.add_signal_handler(signal.SIGTERM, self.stop, server)
+		except (ValueError, RuntimeError):
+			pass # not running in the main thread
+		async with server:
+			try:
+				await server.serve_forever()
+			except asyncio.CancelledError:
+				pass
+
+			# graceful shutdown: the connections in flight get GracefulTimeout seconds to be served,
+			# the ones left after that are cut off
+			if self.connections:
+				done, pending = await asyncio.wait(self.connections, timeout = self.server.state.graceful_timeout)
+				for task in pending:
+					task.cancel()
+				if pending:
+					await asyncio.wait(pending)
+
+	def start(self):
+		try:
+			asyncio.run(self.serve())
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.executor.shutdown(wait = True)
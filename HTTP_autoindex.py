@@ -0,0 +1,129 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from html import escape
+from urllib.parse import quote
+
+# rows of a listing joined into one body chunk, so a page of tens of thousands of entries goes
+# out as a few hundred buffers rather than one per row or one huge copy
+LISTING_CHUNK_ROWS = 512
+
+#sorted, rendered listing of one version of a directory: one preencoded table row per entry, so
+#any page of it is served by slicing and joining rows
+class DirectoryListing:
+	__slots__ = ('validator', 'rows', 'size')
+
+	def __init__(self, validator, rows):
+		self.validator = validator # (inode, mtime_ns) of the directory the listing was read from
+		self.rows = rows
+		self.size = sum(len(row) for row in rows)
+
+
+# (inode, mtime_ns) of a directory: adding, removing or renaming an entry changes its mtime.
+# Sizes and dates of files modified in place are only picked up with the next such change
+def directory_validator(st):
+	return (st.st_ino, st.st_mtime_ns)
+
+
+def listing_row(entry):
+	try:
+		is_dir = entry.is_dir()
+		st = entry.stat()
+	except OSError:
+		return None # removed while the directory was scanned
+	name = entry.name + '/' if is_dir else entry.name
+	size = '-' if is_dir else str(st.st_size)
+	modified = time.strftime('%d-%b-%Y %H:%M', time.gmtime(st.st_mtime))
+	# names that aren't valid utf-8 keep their raw bytes in the link and are shown with replacements
+	return is_dir, (f'<tr><td><a href="{quote(name, errors = "surrogateescape")}">{escape(name)}</a></td>'
+		f'<td>{modified}</td><td>{size}</td></tr>\n').encode('utf-8', 'replace')
+
+
+# rows of every entry of a directory, subdirectories first, each group sorted by name. Dotfiles
+# (among them the temporary files of uploads in progress) are left out
+def read_listing(path, st):
+	dirs = []
+	files = []
+	with os.scandir(path) as it:
+		for entry in it:
+			if entry.name.startswith('.'):
+				continue
+			row = listing_row(entry)
+			if row is not None:
+				(dirs if row[0] else files).append((entry.name, row[1]))
+	dirs.sort()
+	files.sort()
+	return DirectoryListing(directory_validator(st), [row for name, row in dirs + files])
+
+
+#LRU cache of directory listings keyed on the resolved directory and revalidated against the
+#stat result the request already has, so a large directory is only scanned again after its
+#entries changed. Bounded by entry count and total row bytes
+class ListingCache:
+	def __init__(self, max_entries = 32, max_bytes = 67108864):
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.entries = OrderedDict()
+		self.size = 0 # row bytes held
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def lookup(self, path, st):
+		validator = directory_validator(st)
+		with self.lock:
+			listing = self.entries.get(path)
+			if listing is not None:
+				if listing.validator == validator:
+					self.entries.move_to_end(path)
+					self.hits += 1
+					return listing
+				self.remove(path)
+			self.misses += 1
+
+		listing = read_listing(path, st)
+		if self.max_entries > 0 and listing.size <= self.max_bytes:
+			with self.lock:
+				if path in self.entries:
+					self.remove(path)
+				self.entries[path] = listing
+				self.size += listing.size
+				while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+					self.remove(next(iter(self.entries)))
+		return listing
+
+	def remove(self, path):
+		self.size -= self.entries.pop(path).size
+
+
+# html page of a listing as a list of body chunks: the rows of page (1-based) of page_size rows,
+# all rows when page_size is 0, between a header and navigation links. None past the last page
+def render_page(listing, uri, page, page_size):
+	count = len(listing.rows)
+	pages = max(1, -(-count // page_size)) if page_size > 0 else 1
+	if page < 1 or page > pages:
+		return None
+	start = (page - 1) * page_size if page_size > 0 else 0
+	end = min(start + page_size, count) if page_size > 0 else count
+
+	title = escape(uri)
+	head = (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Index of {title}</title></head>\n'
+		f'<body><h1>Index of {title}</h1>\n<table>\n'
+		f'<tr><th>Name</th><th>Last modified</th><th>Size</th></tr>\n')
+	if uri != '/':
+		head += '<tr><td><a href="../">../</a></td><td></td><td>-</td></tr>\n'
+	links = []
+	if page > 1:
+		links.append(f'<a href="?page={page - 1}">previous</a>')
+	if pages > 1:
+		links.append(f'page {page} of {pages}')
+	if page < pages:
+		links.append(f'<a href="?page={page + 1}">next</a>')
+	tail = f'</table>\n<p>{" | ".join(links)}</p>\n</body></html>\n' if links else '</table>\n</body></html>\n'
+
+	body = [head.encode('utf-8')]
+	for i in range(start, end, LISTING_CHUNK_ROWS):
+		body.append(b''.join(listing.rows[i : min(i + LISTING_CHUNK_ROWS, end)]))
+	body.append(tail.encode('utf-8'))
+	return body
@@ -0,0 +1,123 @@
+import os
+import threading
+from collections import OrderedDict
+
+#cached view of one static file: everything a response needs that only changes with the file
+class CacheEntry:
+	__slots__ = ('validator', 'content_type', 'last_modified', 'etag', 'body', 'gzip')
+
+	def __init__(self, validator, content_type, last_modified, etag):
+		self.validator = validator # (inode, size, mtime_ns) the entry was built from
+		self.content_type = content_type
+		self.last_modified = last_modified
+		self.etag = etag
+		self.body = None # file contents, only kept for files up to max_file_size
+		self.gzip = None # gzip-compressed contents, False when compressing doesn't pay off
+
+
+# (inode, size, mtime_ns) identifying a version of a file, compared against a fresh stat
+def stat_validator(st):
+	return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+#LRU cache of static file responses keyed on the resolved path, bounded by entry count and
+#total body bytes. Entries are revalidated against the stat result the request already has
+class FileCache:
+	def __init__(self, max_bytes = 67108864, max_entries = 1024, max_file_size = 1048576):
+		self.max_bytes = max_bytes
+		self.max_entries = max_entries
+		self.max_file_size = max_file_size
+		self.entries = OrderedDict()
+		self.size = 0 # body bytes held
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+	# returns the entry for path, rebuilt with build_entry(path, st) if st shows the file
+	# changed since it was cached
+	def lookup(self, path, st, build_entry):
+		validator = stat_validator(st)
+		with self.lock:
+			entry = self.entries.get(path)
+			if entry is not None:
+				if entry.validator == validator:
+					self.entries.move_to_end(path)
+					return entry
+				self.remove(path)
+
+		entry = build_entry(path, st)
+		if self.max_entries > 0:
+			with self.lock:
+				if path in self.entries:
+					self.remove(path)
+				self.entries[path] = entry
+				self.evict()
+		return entry
+
+	# body bytes of a small file, read once (from the binary file open_file returns) and then
+	# served from memory; None for files that are too big to cache (those go through sendfile)
+	def body(self, path, entry, open_file):
+		if entry.body is not None:
+			with self.lock:
+				self.hits += 1
+			return entry.body
+
+		with self.lock:
+			self.misses += 1
+		size = entry.validator[1]
+		if size > self.max_file_size or size > self.max_bytes:
+			return None
+
+		with open_file() as f:
+			body = f.read(size + 1)
+		if len(body) != size:
+			return None # the file changed under us, not caching a torn read
+
+		with self.lock:
+			if self.entries.get(path) is entry and entry.body is None:
+				entry.body = body
+				self.size += size
+				self.evict()
+		return body
+
+	# keeps the gzip variant of a cached file next to its body
+	def store_gzip(self, path, entry, data):
+		with self.lock:
+			if entry.gzip is not None:
+				return
+			entry.gzip = data
+			if data and self.entries.get(path) is entry:
+				self.size += len(data)
+				self.evict()
+
+	# dropping the entry of a file (or of everything under a directory) we modified ourselves
+	def invalidate(self, path):
+		prefix = path.rstrip(os.sep) + os.sep
+		with self.lock:
+			for key in [key for key in self.entries if key == path or key.startswith(prefix)]:
+				self.remove(key)
+				self.invalidations += 1
+
+	def remove(self, path):
+		entry = self.entries.pop(path)
+		if entry.body is not None:
+			self.size -= len(entry.body)
+		if entry.gzip:
+			self.size -= len(entry.gzip)
+
+	def evict(self):
+		while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+			self.remove(next(iter(self.entries)))
+			self.evictions += 1
+
+	def stats(self):
+		return {
+			'entries': len(self.entries),
+			'bytes': self.size,
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+			'invalidations': self.invalidations
+		}
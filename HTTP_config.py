@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+from HTTP_profile import PROFILE_MODES
+
+SERVER_MODES = ('threaded', 'asyncio')
+# when PUT uploads are flushed to disk: never, the file before it replaces the old one, or the
+# file and then its directory entry
+FSYNC_POLICIES = ('off', 'file', 'full')
+# suffixes accepted by byte-size directives
+SIZE_UNITS = {'k': 1024, 'm': 1048576, 'g': 1073741824}
+# when a changed directive takes effect: on reload, when the pre-fork supervisor replaces its
+# workers on reload (a single-process server needs a restart), or only after a restart
+RELOAD, WORKERS, RESTART = 'reload', 'workers', 'restart'
+
+class ConfigError(Exception):
+	pass
+
+
+#one configuration directive: how its words are turned into a typed value, the range that value
+#must lie in and when a change of it takes effect
+class Directive:
+	__slots__ = ('name', 'kind', 'default', 'minimum', 'maximum', 'choices', 'repeat', 'applies')
+
+	def __init__(self, name, kind, default = None, minimum = None, maximum = None, choices = None, repeat = False, applies = RELOAD):
+		self.name = name
+		self.kind = kind # str, int, size, flag, choice, names, cookie, directory or urlpath
+		self.default = default
+		self.minimum = minimum
+		self.maximum = maximum
+		self.choices = choices
+		self.repeat = repeat # may be given several times, the values are collected in a tuple
+		self.applies = applies
+
+	# typed value of the words following the directive name, ValueError saying what is wrong
+	def parse(self, words):
+		kind = self.kind
+		if not words:
+			raise ValueError('needs a value')
+		if kind == 'names':
+			if any('/' in word for word in words):
+				raise ValueError('takes file names, not paths')
+			return tuple(words)
+		if kind == 'cookie':
+			# CookieName name [attribute; ... attribute;]
+			if len(words) > 1 and not words[-1].endswith(';'):
+				raise ValueError('cookie attributes must end with ;')
+			return words[0] + (';' + ' '.join(words[1 : ]) if len(words) > 1 else '')
+		if len(words) > 1:
+			raise ValueError('takes a single value')
+
+		word = words[0]
+		if kind == 'choice':
+			if word not in self.choices:
+				raise ValueError('must be one of ' + ', '.join(self.choices))
+			return word
+		if kind == 'flag':
+			if word.lower() not in ('on', 'off'):
+				raise ValueError('must be on or off')
+			return word.lower() == 'on'
+		if kind == 'directory':
+			if not os.path.isdir(word.strip('/') or '.'):
+				raise ValueError(f'{word} is not a directory')
+			return word
+		if kind == 'urlpath':
+			if word != 'off' and not word.startswith('/'):
+				raise ValueError('must be an absolute path or off')
+			return word
+		if kind in ('int', 'size'):
+			unit = SIZE_UNITS.get(word[-1].lower()) if kind == 'size' else None
+			try:
+				value = int(word[ : -1]) * unit if unit else int(word)
+			except ValueError:
+				raise ValueError('must be an integer' + (' with an optional k, m or g suffix' if kind == 'size' else '')) from None
+			if self.minimum is not None and value < self.minimum:
+				raise ValueError(f'must be at least {self.minimum}')
+			if self.maximum is not None and value > self.maximum:
+				raise ValueError(f'must be at most {self.maximum}')
+			return value
+		return word
+
+
+SCHEMA = {directive.name: directive for directive in (
+	Directive('DocumentRoot', 'directory', ''),
+	Directive('Server', 'str', 'httpserver'),
+	Directive('CookieName', 'cookie', (), repeat = True),
+	Directive('AccessLog', 'str', 'logs/access.log'),
+	Directive('ErrorLog', 'str', 'logs/error.log'),
+	Directive('ServerMode', 'choice', 'threaded', choices = SERVER_MODES, applies = WORKERS),
+	Directive('WorkerProcesses', 'int', 1, 1, 1024, applies = WORKERS),
+	Directive('MaxActiveConn', 'int', 100, 2, 100000, applies = WORKERS),
+	Directive('ListenBacklog', 'int', 128, 1, 65535, applies = WORKERS),
+	Directive('QueueDepth', 'int', 64, 0, 100000, applies = WORKERS),
+	Directive('RetryAfter', 'int', 1, 0, 86400),
+	Directive('KeepAliveTimeout', 'int', 5, 1, 3600),
+	Directive('MaxKeepAliveRequests', 'int', 100, 1),
+	Directive('GracefulTimeout', 'int', 30, 0, 3600),
+	Directive('MaxHeaderSize', 'size', 65536, 1024, 16777216),
+	Directive('MaxBodySize', 'size', 104857600, 0),
+	Directive('SocketSendBuffer', 'size', 0, 0, 268435456),
+	Directive('SocketRecvBuffer', 'size', 0, 0, 268435456),
+	Directive('CacheMaxBytes', 'size', 67108864, 0),
+	Directive('CacheMaxEntries', 'int', 1024, 0),
+	Directive('CacheMaxFileSize', 'size', 1048576, 0),
+	Directive('ETagContentHash', 'flag', False),
+	Directive('MmapMaxBytes', 'size', 268435456, 0),
+	Directive('MmapMaxEntries', 'int', 64, 0, 65536),
+	Directive('MmapMaxFileSize', 'size', 16777216, 0),
+	Directive('MmapMinHits', 'int', 2, 1),
+	Directive('PathCacheMaxEntries', 'int', 4096, 0),
+	Directive('DirectoryIndex', 'names', ('index.html',)),
+	Directive('AutoIndex', 'flag', False),
+	Directive('AutoIndexPageSize', 'int', 1000, 0),
+	Directive('AutoIndexCacheEntries', 'int', 32, 0),
+	Directive('LogBatchSize', 'int', 256, 1, 65536),
+	Directive('LogFlushInterval', 'int', 1000, 1, 60000),
+	Directive('MultipartMaxParts', 'int', 100, 1),
+	Directive('MultipartMaxFieldSize', 'size', 65536, 0),
+	Directive('MultipartMaxHeaderSize', 'size', 8192, 256),
+	Directive('PutFsync', 'choice', 'off', choices = FSYNC_POLICIES),
+	Directive('MetricsPath', 'urlpath', 'off', applies = RESTART),
+	Directive('Profile', 'choice', 'off', choices = PROFILE_MODES),
+	Directive('ProfileOutput', 'str', 'logs/profile'),
+	Directive('ProfileSlowRequests', 'int', 20, 1, 10000),
+	Directive('ProfileSampleInterval', 'int', 10, 1, 60000),
+	Directive('ConfigWatchInterval', 'int', 0, 0, 3600),
+)}
+
+
+#validated snapshot of the config file: every directive of the schema with its typed value or
+#default. It is never modified; a reload compiles a new one and swaps the reference, so readers
+#need no lock
+class Config:
+	__slots__ = ('values', 'mtime')
+
+	def __init__(self, values, mtime = None):
+		self.values = {name: values.get(name, directive.default) for name, directive in SCHEMA.items()}
+		self.mtime = mtime # of the file the snapshot was read from
+
+	def __getitem__(self, name):
+		return self.values[name]
+
+	def get(self, name, default = None):
+		return self.values.get(name, default)
+
+	# copy of the snapshot with some values replaced
+	def replace(self, values):
+		return Config(dict(self.values, **values), self.mtime)
+
+	# directives whose value differs from the one in other
+	def changed(self, other):
+		return [name for name in SCHEMA if self.values[name] != other.values[name]]
+
+
+# values of the directives in the lines of a config file and the problems found, each as
+# 'line n: message'. Invalid lines are left out; every line is checked, not just up to the first
+# error
+def parse_config(lines):
+	values = {}
+	errors = []
+	for number, line in enumerate(lines, 1):
+		words = line.split('#', 1)[0].split()
+		if not words:
+			continue
+		name, words = words[0], words[1 : ]
+		directive = SCHEMA.get(name)
+		if directive is None:
+			errors.append(f'line {number}: unknown directive {name}')
+			continue
+		if name in values and not directive.repeat:
+			errors.append(f'line {number}: {name} given more than once, the first value is used')
+			continue
+		try:
+			value = directive.parse(words)
+		except ValueError as e:
+			errors.append(f'line {number}: {name} {e}')
+			continue
+		values[name] = values.get(name, ()) + (value,) if directive.repeat else value
+	return values, errors
+
+
+# (Config, errors) of a config file; ConfigError when it can't be read
+def load_config(path):
+	try:
+		with open(path, 'r') as f:
+			mtime = os.fstat(f.fileno()).st_mtime_ns
+			lines = f.readlines()
+	except OSError as e:
+		raise ConfigError(f'Cannot read {path}: {e}') from None
+	values, errors = parse_config(lines)
+	return Config(values, mtime), errors
+
+
+#polls the config file's modification time and calls reload when it changes, every interval()
+#seconds (0: not watching)
+class ConfigWatcher(threading.Thread):
+	def __init__(self, path, interval, reload):
+		super().__init__(daemon = True)
+		self.path = path
+		self.interval = interval
+		self.reload = reload
+		self.mtime = self.stat()
+
+	def stat(self):
+		try:
+			return os.stat(self.path).st_mtime_ns
+		except OSError:
+			return None
+
+	def run(self):
+		while True:
+			interval = self.interval()
+			time.sleep(interval or 1)
+			mtime = self.stat()
+			if interval and mtime is not None and mtime != self.mtime:
+				self.mtime = mtime
+				self.reload()
@@ -0,0 +1,107 @@
+import datetime
+import os
+import queue
+import threading
+import time
+import tzlocal
+
+#log timestamps are formatted at most once per second and shared by every record of that second
+class LogTimestamp:
+	def __init__(self, fmt = "%d/%b/%Y:%H:%M:%S %z"):
+		self.fmt = fmt
+		self.timezone = tzlocal.get_localzone()
+		self.cached = (None, None) # (second, formatted), swapped as one tuple so no lock is needed
+
+	def now(self):
+		second = int(time.time())
+		cached_second, formatted = self.cached
+		if cached_second != second:
+			formatted = datetime.datetime.fromtimestamp(second, self.timezone).strftime(self.fmt)
+			self.cached = (second, formatted)
+		return formatted
+
+
+#asynchronous log pipeline: request threads only queue their lines, a background writer appends
+#them in batches to log files it keeps open. Files are reopened on request (SIGHUP after logrotate)
+class LogWriter:
+	def __init__(self, batch_size = 256, flush_interval = 1.0, queue_size = 65536):
+		# (lines per batch, seconds a line may wait for its batch), replaced as one tuple on reload
+		self.limits = (batch_size, flush_interval)
+		self.queue = queue.Queue(maxsize = queue_size)
+		self.files = {} # path -> open file
+		self.dropped = 0 # lines lost because the queue was full
+		self.reopen_requested = False
+		self.thread = None
+		self.pid = None
+		self.lock = threading.Lock()
+
+	# the writer thread is started lazily, and again in a forked worker process
+	def ensure_started(self):
+		if self.pid == os.getpid():
+			return
+		with self.lock:
+			if self.pid != os.getpid():
+				self.files = {}
+				self.thread = threading.Thread(target = self.run, daemon = True)
+				self.thread.start()
+				self.pid = os.getpid()
+
+	def write(self, path, line):
+		self.ensure_started()
+		try:
+			self.queue.put_nowait((path, line))
+		except queue.Full:
+			self.dropped += 1 # never stall a request on logging
+
+	def reopen(self, signum = None, frame = None):
+		self.reopen_requested = True
+
+	def run(self):
+		while True:
+			batch = []
+			batch_size, flush_interval = self.limits
+			deadline = time.monotonic() + flush_interval
+			try:
+				while len(batch) < batch_size:
+					item = self.queue.get(timeout = max(deadline - time.monotonic(), 0))
+					if item is None:
+						self.flush(batch)
+						return
+					batch.append(item)
+			except queue.Empty:
+				pass
+			self.flush(batch)
+
+	def flush(self, batch):
+		if self.reopen_requested:
+			self.reopen_requested = False
+			self.close_files()
+		if not batch:
+			return
+
+		lines = {}
+		for path, line in batch:
+			lines.setdefault(path, []).append(line)
+		for path, path_lines in lines.items():
+			try:
+				f = self.files.get(path)
+				if f is None:
+					f = self.files[path] = open(path, 'a')
+				f.write(''.join(path_lines))
+				f.flush()
+			except OSError as e:
+				print(f'Log write to {path} failed: {e}')
+
+	def close_files(self):
+		for f in self.files.values():
+			f.close()
+		self.files = {}
+
+	# writes out whatever is queued and stops the writer
+	def close(self):
+		if self.pid != os.getpid():
+			return
+		self.queue.put(None)
+		self.thread.join()
+		self.close_files()
+		self.pid = None
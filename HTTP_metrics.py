@@ -0,0 +1,113 @@
+import bisect
+import threading
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# labels of the request phases timed in http_phase_seconds
+PHASE_PARSE = (('phase', 'parse'),)
+PHASE_HANDLER = (('phase', 'handler'),)
+PHASE_SEND = (('phase', 'send'),)
+
+def format_labels(labels, extra = ''):
+	pairs = [f'{name}="{value}"' for name, value in labels]
+	if extra:
+		pairs.append(extra)
+	return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value):
+	return repr(value) if isinstance(value, float) else str(value)
+
+
+#in-process metrics registry, cheap enough to leave on: every thread updates its own shard of
+#counters and histograms without taking a lock, a scrape adds the shards up. Gauges are
+#callables read at scrape time. Labels are tuples of (name, value) pairs
+class Metrics:
+	def __init__(self, buckets = LATENCY_BUCKETS):
+		self.buckets = buckets
+		self.local = threading.local()
+		self.shards = [] # (counters, histograms) of every thread that recorded something
+		self.lock = threading.Lock() # only taken when a thread creates its shard
+		self.descriptions = {} # metric name -> (type, help)
+		self.functions = [] # (name, function returning a number or {labels: number})
+		self.labels = () # added to every series, e.g. the worker process a scrape was answered by
+
+	def shard(self):
+		try:
+			return self.local.shard
+		except AttributeError:
+			shard = self.local.shard = ({}, {})
+			with self.lock:
+				self.shards.append(shard)
+			return shard
+
+	def describe(self, name, kind, help):
+		self.descriptions[name] = (kind, help)
+
+	# a metric whose value is read from function at scrape time, for state that other objects
+	# keep anyway (connection counts, cache statistics)
+	def gauge(self, name, help, function, kind = 'gauge'):
+		self.describe(name, kind, help)
+		self.functions.append((name, function))
+
+	def inc(self, name, labels = (), value = 1):
+		counters = self.shard()[0]
+		key = (name, labels)
+		counters[key] = counters.get(key, 0) + value
+
+	def observe(self, name, labels, seconds):
+		histograms = self.shard()[1]
+		key = (name, labels)
+		histogram = histograms.get(key)
+		if histogram is None:
+			# one count per bucket, the +Inf bucket, then the sum of the observations
+			histogram = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+		histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+		histogram[-1] += seconds
+
+	# the shards added up: ({(name, labels): value}, {(name, labels): histogram})
+	def collect(self):
+		counters = {}
+		histograms = {}
+		with self.lock:
+			shards = list(self.shards)
+		for shard_counters, shard_histograms in shards:
+			for key, value in list(shard_counters.items()):
+				counters[key] = counters.get(key, 0) + value
+			for key, histogram in list(shard_histograms.items()):
+				total = histograms.get(key)
+				if total is None:
+					histograms[key] = list(histogram)
+				else:
+					histograms[key] = [a + b for a, b in zip(total, histogram)]
+		return counters, histograms
+
+	# every metric in the Prometheus text exposition format
+	def render(self):
+		counters, histograms = self.collect()
+		common = self.labels
+		samples = {} # name -> [lines]
+		for (name, labels), value in sorted(counters.items()):
+			samples.setdefault(name, []).append(f'{name}{format_labels(common + labels)} {format_value(value)}')
+		for (name, labels), histogram in sorted(histograms.items()):
+			labels = common + labels
+			lines = samples.setdefault(name, [])
+			cumulative = 0
+			for bound, count in zip(self.buckets + ('+Inf',), histogram):
+				cumulative += count
+				le = 'le="%s"' % bound
+				lines.append(f'{name}_bucket{format_labels(labels, le)} {cumulative}')
+			lines.append(f'{name}_sum{format_labels(labels)} {format_value(histogram[-1])}')
+			lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+		for name, function in self.functions:
+			value = function()
+			lines = samples.setdefault(name, [])
+			for labels, number in (value.items() if isinstance(value, dict) else [((), value)]):
+				lines.append(f'{name}{format_labels(common + labels)} {format_value(number)}')
+
+		out = []
+		for name, lines in samples.items():
+			kind, help = self.descriptions.get(name, ('untyped', ''))
+			out.append(f'# HELP {name} {help}')
+			out.append(f'# TYPE {name} {kind}')
+			out += lines
+		return ('\n'.join(out) + '\n').encode('utf-8')
@@ -0,0 +1,141 @@
+import os
+import mmap
+import threading
+from collections import OrderedDict
+from HTTP_cache import stat_validator
+
+#read-only mapping of one version of a file, shared by every response sending from it. Unmapped
+#once it was dropped from the pool and the last response using it is done
+class MappedFile:
+	__slots__ = ('map', 'validator', 'users', 'stale')
+
+	def __init__(self, mapping, validator):
+		self.map = mapping
+		self.validator = validator # (inode, size, mtime_ns) the mapping was made from
+		self.users = 0
+		self.stale = False
+
+
+#response body (or byte range of one) sent straight from a shared mapping through a memoryview,
+#without copying it into a bytes object. Holds a reference on the mapping until closed
+class MappedBody:
+	__slots__ = ('pool', 'mapped', 'view', 'count')
+
+	def __init__(self, pool, mapped, offset, count):
+		self.pool = pool
+		self.mapped = mapped
+		self.view = memoryview(mapped.map)[offset : offset + count]
+		self.count = count
+		pool.retain(mapped)
+
+	def close(self):
+		if self.view is not None:
+			self.view.release()
+			self.view = None
+			self.pool.release(self.mapped)
+
+
+#pool of mmaps for mid-size hot files: too big for the FileCache's bytes but served often enough
+#that opening the file on every request doesn't pay. A file is mapped once it was asked for
+#min_hits times, then every concurrent reader sends from the same page-cache mapping. Mappings
+#are revalidated against the stat result the request already has and kept in an LRU bounded by
+#entry count (each mapping keeps a descriptor) and mapped bytes. PUT replaces files by rename,
+#so a mapping never sees its file truncated by the server itself
+class MmapPool:
+	def __init__(self, max_bytes = 268435456, max_entries = 64, max_file_size = 16777216, min_hits = 2):
+		self.max_bytes = max_bytes
+		self.max_entries = max_entries
+		self.max_file_size = max_file_size
+		self.min_hits = min_hits
+		self.entries = OrderedDict() # path -> MappedFile
+		self.candidates = OrderedDict() # path -> requests seen while not mapped
+		self.size = 0 # bytes mapped
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.maps = 0
+
+	# MappedFile of the version of path described by st, retained for the caller (who releases
+	# it); None when the file isn't (yet) worth mapping. open_file returns the file to map
+	def acquire(self, path, st, open_file):
+		size = st.st_size
+		if self.max_entries <= 0 or size == 0 or size > self.max_file_size or size > self.max_bytes:
+			return None
+		validator = stat_validator(st)
+		with self.lock:
+			mapped = self.entries.get(path)
+			if mapped is not None:
+				if mapped.validator == validator:
+					self.entries.move_to_end(path)
+					mapped.users += 1
+					self.hits += 1
+					return mapped
+				self.remove(path)
+
+			hits = self.candidates.pop(path, 0) + 1
+			if hits < self.min_hits:
+				self.candidates[path] = hits
+				while len(self.candidates) > self.max_entries * 4:
+					self.candidates.popitem(last = False)
+				return None
+
+		try:
+			with open_file() as f:
+				mapping = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		except (OSError, ValueError):
+			return None
+		if len(mapping) != size:
+			mapping.close() # the file changed since it was stat'ed
+			return None
+
+		mapped = MappedFile(mapping, validator)
+		mapped.users += 1
+		with self.lock:
+			if path in self.entries:
+				self.remove(path)
+			self.entries[path] = mapped
+			self.size += size
+			self.maps += 1
+			self.evict()
+		return mapped
+
+	def retain(self, mapped):
+		with self.lock:
+			mapped.users += 1
+
+	def release(self, mapped):
+		with self.lock:
+			mapped.users -= 1
+			if mapped.stale and mapped.users == 0:
+				self.unmap(mapped)
+
+	def unmap(self, mapped):
+		try:
+			mapped.map.close()
+		except BufferError:
+			pass # a transport still holds a view; the mapping goes away with the last one
+
+	def remove(self, path):
+		mapped = self.entries.pop(path)
+		self.size -= len(mapped.map)
+		mapped.stale = True
+		if mapped.users == 0:
+			self.unmap(mapped)
+
+	def evict(self):
+		while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+			self.remove(next(iter(self.entries)))
+
+	# dropping the mapping of a file (or of everything under a directory) we modified ourselves
+	def invalidate(self, path):
+		prefix = path.rstrip(os.sep) + os.sep
+		with self.lock:
+			for key in [key for key in self.entries if key == path or key.startswith(prefix)]:
+				self.remove(key)
+			for key in [key for key in self.candidates if key == path or key.startswith(prefix)]:
+				del self.candidates[key]
+
+	def close(self):
+		with self.lock:
+			for path in list(self.entries):
+				self.remove(path)
+			self.candidates.clear()
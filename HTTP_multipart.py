@@ -0,0 +1,154 @@
+import re
+from HTTP_reader import RECV_SIZE, RequestError
+
+# name=value and name="quoted value" parameters of a header field
+HEADER_PARAM = re.compile(r';\s*([^\s=;]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^;]*))')
+
+# parameters of a Content-Type or Content-Disposition value, names lowercased
+def header_params(value):
+	params = {}
+	for name, quoted, token in HEADER_PARAM.findall(value):
+		params[name.lower()] = re.sub(r'\\(.)', r'\1', quoted) if quoted else token.strip()
+	return params
+
+
+#one part of a multipart/form-data body: its header fields, and its data streamed off the
+#request body in chunks as it is iterated. Data the handler doesn't read is skipped
+class Part:
+	__slots__ = ('reader', 'headers', 'name', 'filename', 'content_type', 'size', 'done')
+
+	def __init__(self, reader, headers):
+		self.reader = reader
+		self.headers = headers # lowercased name -> value
+		disposition = header_params(headers.get('content-disposition', ''))
+		self.name = disposition.get('name')
+		self.filename = disposition.get('filename') # None for plain form fields
+		self.content_type = headers.get('content-type', 'text/plain')
+		self.size = 0 # data bytes read so far
+		self.done = False
+
+	def __iter__(self):
+		while not self.done:
+			chunk = self.reader.read_data()
+			if chunk is None:
+				self.done = True
+				return
+			self.size += len(chunk)
+			yield chunk
+
+	# whole data of a form field, 413 past limit bytes
+	def read(self, limit):
+		data = bytearray()
+		for chunk in self:
+			data += chunk
+			if len(data) > limit:
+				raise RequestError(413, 'Multipart field too large')
+		return bytes(data)
+
+
+#incremental multipart/form-data parser over a RequestBody: parts are iterated in order and
+#their data is read from the socket in RECV_SIZE chunks, so memory stays bounded by the chunk
+#size whatever the size of the uploaded files
+class MultipartReader:
+	def __init__(self, body, boundary, max_parts = 100, max_header_size = 8192):
+		self.body = body
+		# the CRLF before each boundary belongs to it; the one prepended lets the first
+		# boundary match the same delimiter even without a preamble
+		self.delimiter = b'\r\n--' + boundary.encode('iso-8859-1')
+		self.buffer = bytearray(b'\r\n')
+		self.max_parts = max_parts
+		self.max_header_size = max_header_size
+		self.parts = 0
+		self.current = None
+		self.finished = False
+
+	def fill(self):
+		chunk = self.body.read(RECV_SIZE)
+		if not chunk:
+			raise RequestError(400, 'Multipart body ended before its closing boundary')
+		self.buffer += chunk
+
+	def __iter__(self):
+		# the preamble is read like the data of a part nobody wants
+		while self.read_data() is not None:
+			pass
+		while True:
+			if self.current is not None:
+				for chunk in self.current:
+					pass
+			part = self.next_part()
+			if part is None:
+				return
+			yield part
+
+	# next chunk of the current part's data, None once its closing delimiter was consumed
+	def read_data(self):
+		while True:
+			end = self.buffer.find(self.delimiter)
+			if end != -1:
+				if end:
+					data = bytes(self.buffer[ : end])
+					del self.buffer[ : end]
+					return data
+				del self.buffer[ : len(self.delimiter)]
+				self.end_of_delimiter()
+				return None
+			# everything but a possible beginning of the delimiter can be handed out
+			keep = len(self.delimiter) - 1
+			if len(self.buffer) > keep:
+				data = bytes(self.buffer[ : -keep])
+				del self.buffer[ : -keep]
+				return data
+			self.fill()
+
+	# after a delimiter: '--' closes the body, otherwise (after optional padding) a CRLF
+	# starts the next part
+	def end_of_delimiter(self):
+		while len(self.buffer) < 2:
+			self.fill()
+		if self.buffer[ : 2] == b'--':
+			self.finished = True
+			return
+		while True:
+			line_end = self.buffer.find(b'\r\n')
+			if line_end != -1:
+				break
+			if len(self.buffer) > self.max_header_size:
+				raise RequestError(400, 'Malformed multipart boundary')
+			self.fill()
+		if self.buffer[ : line_end].strip(b' \t'):
+			raise RequestError(400, 'Malformed multipart boundary')
+		del self.buffer[ : line_end + 2]
+
+	# header fields of the next part, None after the closing boundary
+	def next_part(self):
+		if self.finished:
+			return None
+		self.parts += 1
+		if self.parts > self.max_parts:
+			raise RequestError(413, 'Too many multipart parts')
+
+		while True:
+			if self.buffer[ : 2] == b'\r\n':
+				end = 0
+				break
+			end = self.buffer.find(b'\r\n\r\n')
+			if end != -1:
+				break
+			if len(self.buffer) > self.max_header_size:
+				raise RequestError(413, 'Multipart part headers too large')
+			self.fill()
+		if end > self.max_header_size:
+			raise RequestError(413, 'Multipart part headers too large')
+
+		headers = {}
+		block = self.buffer[ : end].decode('utf-8', 'replace')
+		del self.buffer[ : end + (2 if end == 0 else 4)]
+		for line in block.split('\r\n') if block else []:
+			name, colon, value = line.partition(':')
+			if not colon:
+				raise RequestError(400, 'Malformed multipart part header')
+			headers[name.strip().lower()] = value.strip()
+
+		self.current = Part(self, headers)
+		return self.current
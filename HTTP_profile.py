@@ -0,0 +1,164 @@
+import cProfile
+import heapq
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+
+PROFILE_MODES = ('off', 'sample', 'cprofile')
+# frames marking a thread that is working on a request, the only stacks the sampler keeps
+REQUEST_FRAMES = ('handle_request', 'send_response', 'send')
+
+#timings of one traced request
+class RequestTrace:
+	__slots__ = ('req_line', 'started', 'phases', 'profile')
+
+	def __init__(self, req_line):
+		self.req_line = req_line
+		self.started = time.perf_counter()
+		self.phases = {} # phase -> seconds
+		self.profile = None # cProfile.Profile when this request was picked for profiling
+
+
+#settings of a profiling run, replaced as a whole on reload
+class ProfileSettings:
+	__slots__ = ('mode', 'output', 'slow_requests', 'interval')
+
+	def __init__(self, mode = 'sample', output = 'logs/profile', slow_requests = 20, interval = 0.01):
+		self.mode = mode
+		self.output = output # path prefix of the reports
+		self.slow_requests = slow_requests # slowest requests kept
+		self.interval = interval # seconds between stack samples
+
+
+#request profiler switched on at runtime (Profile directive or SIGUSR1). While on, every request
+#is traced with its per-phase timings and the slowest ones are kept; 'sample' mode also samples
+#the stacks of threads working on requests for a flamegraph (collapsed-stack output), 'cprofile'
+#mode runs cProfile over requests one at a time. While off, the servers only test enabled
+class Profiler:
+	def __init__(self):
+		self.enabled = False
+		self.settings = ProfileSettings() # for the next run
+		self.active = self.settings # of the running (or last) run, kept until it is stopped
+		self.local = threading.local()
+		self.lock = threading.Lock()
+		self.cprofile_lock = threading.Lock() # only one cProfile can be active at a time
+		self.sequence = itertools.count()
+		self.reset()
+
+	def reset(self):
+		self.slowest = [] # min-heap of (seconds, sequence, trace)
+		self.stacks = {} # collapsed stack -> samples
+		self.stats = None # pstats.Stats merged over the profiled requests
+
+	def start(self):
+		with self.lock:
+			if self.enabled:
+				return
+			self.reset()
+			self.active = self.settings
+			self.enabled = True
+		print(f'Profiling requests ({self.active.mode})')
+		if self.active.mode == 'sample':
+			threading.Thread(target = self.sample, daemon = True).start()
+
+	def stop(self):
+		with self.lock:
+			if not self.enabled:
+				return
+			self.enabled = False
+		self.dump()
+
+	# SIGUSR1 switches profiling on, or off with the reports written out
+	def toggle(self, signum = None, frame = None):
+		threading.Thread(target = self.stop if self.enabled else self.start).start()
+
+	# called by the servers for each request while enabled
+	def begin(self, head):
+		trace = RequestTrace(head[ : head.find(b'\r\n')].decode('iso-8859-1'))
+		if self.active.mode == 'cprofile' and self.cprofile_lock.acquire(blocking = False):
+			trace.profile = cProfile.Profile()
+		return trace
+
+	# runs function (the request handler) as part of trace, in the thread it is called from
+	def call(self, trace, function, *args):
+		self.local.trace = trace
+		if trace.profile is None:
+			try:
+				return function(*args)
+			finally:
+				self.local.trace = None
+
+		try:
+			return trace.profile.runcall(function, *args)
+		finally:
+			self.local.trace = None
+			with self.lock:
+				if self.stats is None:
+					self.stats = pstats.Stats(trace.profile)
+				else:
+					self.stats.add(trace.profile)
+			trace.profile = None
+			self.cprofile_lock.release()
+
+	# records a phase timing measured inside the handler for the trace being run by this thread
+	def phase(self, name, seconds):
+		trace = getattr(self.local, 'trace', None)
+		if trace is not None:
+			trace.phases[name] = seconds
+
+	def end(self, trace, send_seconds):
+		trace.phases['send'] = send_seconds
+		total = time.perf_counter() - trace.started
+		with self.lock:
+			entry = (total, next(self.sequence), trace)
+			if len(self.slowest) < self.active.slow_requests:
+				heapq.heappush(self.slowest, entry)
+			else:
+				heapq.heappushpop(self.slowest, entry)
+
+	# stack sampler thread: counts the call stacks of the threads that are handling a request
+	def sample(self):
+		me = threading.get_ident()
+		settings = self.active
+		while self.enabled and self.active is settings:
+			for ident, frame in sys._current_frames().items():
+				if ident == me:
+					continue
+				stack = []
+				busy = False
+				while frame is not None:
+					code = frame.f_code
+					busy = busy or code.co_name in REQUEST_FRAMES
+					stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+					frame = frame.f_back
+				if busy:
+					key = ';'.join(reversed(stack))
+					self.stacks[key] = self.stacks.get(key, 0) + 1
+			time.sleep(settings.interval)
+
+	# writes the reports collected since profiling was switched on: the slowest requests with
+	# their phase timings, and the collapsed stacks or cProfile statistics
+	def dump(self):
+		prefix = f'{self.active.output}-{os.getpid()}'
+		with self.lock:
+			slowest = sorted(self.slowest, reverse = True)
+			stacks = dict(self.stacks)
+			stats = self.stats
+		try:
+			with open(prefix + '.slow.txt', 'w') as f:
+				for total, sequence, trace in slowest:
+					phases = ' '.join(f'{name}={seconds * 1000:.3f}ms' for name, seconds in trace.phases.items())
+					f.write(f'{total * 1000:.3f}ms {phases} "{trace.req_line}"\n')
+			if stacks:
+				# one 'frame;frame;frame count' line per stack, the input of flamegraph.pl
+				with open(prefix + '.collapsed', 'w') as f:
+					for stack, count in sorted(stacks.items()):
+						f.write(f'{stack} {count}\n')
+			if stats is not None:
+				stats.dump_stats(prefix + '.pstats')
+			print(f'Profile written to {prefix}.*')
+		except OSError as e:
+			print(f'Profile dump to {prefix} failed: {e}')
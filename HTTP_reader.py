@@ -0,0 +1,204 @@
+import re
+
+RECV_SIZE = 65536
+# interim response sent when a client waiting on Expect: 100-continue may send its body
+CONTINUE = b'HTTP/1.1 100 Continue\r\n\r\n'
+# chunk-size is hex digits only, no sign, prefix or separators (RFC 9112 7.1)
+CHUNK_SIZE = re.compile(rb'[0-9A-Fa-f]+')
+
+# raised while reading a request that cannot be framed or breaks a configured limit;
+# status_code is the HTTP status the client should be answered with
+class RequestError(Exception):
+	def __init__(self, status_code, message = ''):
+		super().__init__(message)
+		self.status_code = status_code
+
+
+#incremental reader framing HTTP requests out of a client socket
+class RequestReader:
+	def __init__(self, sock, max_header_size = 65536, max_body_size = 104857600):
+		self.sock = sock
+		self.buffer = bytearray()
+		self.max_header_size = max_header_size
+		self.max_body_size = max_body_size
+
+	# receives more bytes into the buffer, returns False once the peer has closed
+	def fill(self, size = RECV_SIZE):
+		chunk = self.sock.recv(size)
+		if not chunk:
+			return False
+		self.buffer += chunk
+		return True
+
+	# returns up to size bytes, served from the buffer first and the socket after
+	def read_some(self, size):
+		if not self.buffer:
+			return self.sock.recv(min(size, RECV_SIZE))
+		data = bytes(self.buffer[ : size])
+		del self.buffer[ : size]
+		return data
+
+	def send_continue(self):
+		self.sock.sendall(CONTINUE)
+
+	def readline(self, limit = 8192):
+		while True:
+			end = self.buffer.find(b'\r\n')
+			if end != -1:
+				line = bytes(self.buffer[ : end])
+				del self.buffer[ : end + 2]
+				return line
+			if len(self.buffer) > limit:
+				raise RequestError(400, 'Line too long')
+			if not self.fill():
+				raise ConnectionError('Connection closed mid-request')
+
+	# buffers until the end of the header block and returns it, None if the client went away
+	def read_head(self):
+		while True:
+			# clients may send stray CRLFs between pipelined requests
+			while self.buffer[ : 2] == b'\r\n':
+				del self.buffer[ : 2]
+			end = self.buffer.find(b'\r\n\r\n')
+			if end != -1:
+				break
+			if len(self.buffer) > self.max_header_size:
+				raise RequestError(431, 'Request header fields too large')
+			if not self.fill():
+				return None
+
+		end += 4
+		if end > self.max_header_size:
+			raise RequestError(431, 'Request header fields too large')
+		head = bytes(self.buffer[ : end])
+		del self.buffer[ : end]
+		return head
+
+	# returns (head, body) for the next request; body is a RequestBody or None when the
+	# request carries no message body
+	def read_request(self):
+		head = self.read_head()
+		if head is None:
+			return None, None
+
+		length, chunked, expect_continue = body_framing(head, self.max_body_size)
+		if chunked or length is not None:
+			return head, RequestBody(self, length, chunked, expect_continue)
+		return head, None
+
+
+# returns (Content-Length, chunked, Expect: 100-continue) announced by a request header block.
+# Framing a server could read differently from a proxy in front of it is refused (RFC 9112 6.3):
+# a Transfer-Encoding not ending in chunked, one sent along with Content-Length, and
+# Content-Length values that disagree
+def body_framing(head, max_body_size):
+	codings = None
+	lengths = set()
+	expect_continue = False
+	for line in head.split(b'\r\n')[1 : ]:
+		name, _, value = line.partition(b':')
+		name = name.strip().lower()
+		if name == b'transfer-encoding':
+			codings = (codings or []) + [coding.strip().lower() for coding in value.split(b',') if coding.strip()]
+		elif name == b'content-length':
+			# a repeated header or a list may only repeat the same value
+			for item in value.split(b','):
+				item = item.strip()
+				if not item.isdigit():
+					raise RequestError(400, 'Invalid Content-Length')
+				lengths.add(int(item))
+		elif name == b'expect':
+			expect_continue = value.strip().lower() == b'100-continue'
+
+	# message-body signaled by inclusion of Content-Length or Transfer-Encoding header field;
+	# a request with both is refused, as the two could be read differently (request smuggling)
+	if codings is not None:
+		if lengths:
+			raise RequestError(400, 'Both Transfer-Encoding and Content-Length')
+		if not codings or codings[-1] != b'chunked' or codings.count(b'chunked') > 1:
+			raise RequestError(400, 'Invalid Transfer-Encoding')
+		if len(codings) > 1:
+			raise RequestError(501, 'Transfer coding not implemented') # only chunked is decoded
+		return None, True, expect_continue
+	if len(lengths) > 1:
+		raise RequestError(400, 'Conflicting Content-Length')
+	length = lengths.pop() if lengths else None
+	if length is not None and length > max_body_size:
+		raise RequestError(413, 'Content too large')
+	return length, False, expect_continue
+
+
+#file-like view of a request body, decoded from the socket as the handler reads it. A client
+#that sent Expect: 100-continue gets its 100 Continue on the first read, so a handler answering
+#before it reads the body rejects the request before any of it is transferred
+class RequestBody:
+	def __init__(self, reader, length = None, chunked = False, expect_continue = False):
+		self.reader = reader
+		self.length = length # Content-Length, None for chunked bodies
+		self.chunked = chunked
+		self.remaining = 0 if chunked else length # bytes left in the body (or current chunk)
+		self.received = 0
+		self.done = length == 0
+		self.continue_pending = expect_continue and not self.done # client still waits for 100 Continue
+
+	def read(self, size = -1):
+		if size is None or size < 0:
+			return b''.join(iter(lambda: self.read(RECV_SIZE), b''))
+
+		if self.done or size == 0:
+			return b''
+
+		if self.continue_pending:
+			self.continue_pending = False
+			self.reader.send_continue()
+
+		if self.chunked and self.remaining == 0:
+			self.next_chunk()
+			if self.done:
+				return b''
+
+		data = self.reader.read_some(min(size, self.remaining))
+		if not data:
+			raise ConnectionError('Connection closed mid-body')
+		self.remaining -= len(data)
+		self.received += len(data)
+
+		if self.remaining == 0:
+			if self.chunked:
+				if self.reader.readline() != b'':
+					raise RequestError(400, 'Malformed chunked body')
+			else:
+				self.done = True
+		return data
+
+	def next_chunk(self):
+		line = self.reader.readline()
+		size = line.split(b';', 1)[0].strip()
+		if not CHUNK_SIZE.fullmatch(size):
+			raise RequestError(400, 'Malformed chunk size')
+		size = int(size, 16)
+		if size == 0:
+			# skipping trailer fields up to the terminating blank line
+			while self.reader.readline() != b'':
+				pass
+			self.done = True
+			return
+		if self.received + size > self.reader.max_body_size:
+			raise RequestError(413, 'Content too large')
+		self.remaining = size
+
+	def __iter__(self):
+		return iter(lambda: self.read(RECV_SIZE), b'')
+
+	# consumes what the handler left unread so the next pipelined request can be framed,
+	# returns False if more than limit bytes were left, or if the client was never told to send
+	# its body (the connection should be closed then)
+	def drain(self, limit = RECV_SIZE):
+		if self.continue_pending:
+			return False
+		drained = 0
+		while not self.done:
+			if drained > limit:
+				return False
+			drained += len(self.read(RECV_SIZE))
+		return True
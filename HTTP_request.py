@@ -1,50 +1,139 @@
-import socket
-from http import HTTPStatus
-from TCP_Server import TCPServer
-import mimetypes
-import os
-import shutil
-from uuid import uuid4
 import re
-import time
+from urllib.parse import unquote_to_bytes, parse_qs
 
-#http request class for parsing and processing incoming reqs
+# method SP request-target SP HTTP-version; the target holds no whitespace or control bytes
+REQUEST_LINE = re.compile(r"([!#$%&'*+.^_`|~0-9A-Za-z-]+) ([^\x00-\x20\x7f]+) (HTTP/[0-9]\.[0-9])")
+# header field lines: a token name directly followed by a colon, no bare CR or LF anywhere.
+# This also rejects whitespace before the colon and obsolete line folding
+HEADER_BLOCK = re.compile(r"[!#$%&'*+.^_`|~0-9A-Za-z-]+:[^\r\n]*(?:\r\n[!#$%&'*+.^_`|~0-9A-Za-z-]+:[^\r\n]*)*")
+# a '%' not followed by two hex digits
+BAD_ESCAPE = re.compile(rb'%(?![0-9A-Fa-f]{2})')
+# control characters, which no path may contain raw or percent-encoded
+CONTROL = re.compile(r'[\x00-\x1f\x7f]')
+
+#header fields of a request, looked up case-insensitively. Repeated fields are combined into
+#one comma-separated value while parsing, as RFC 9110 allows
+class Headers:
+	__slots__ = ('fields',)
+
+	def __init__(self, fields = None):
+		self.fields = {} if fields is None else fields # lowercased name -> value
+
+	def get(self, name, default = None):
+		return self.fields.get(name.lower(), default)
+
+	def __getitem__(self, name):
+		return self.fields[name.lower()]
+
+	def __contains__(self, name):
+		return name.lower() in self.fields
+
+	def __len__(self):
+		return len(self.fields)
+
+	def __iter__(self):
+		return iter(self.fields)
+
+
+# percent-decodes the path of a request target (UTF-8) to str, None if it is malformed or
+# contains control characters
+def percent_decode(raw):
+	if '%' not in raw:
+		return None if CONTROL.search(raw) else raw
+	raw = raw.encode('iso-8859-1')
+	if BAD_ESCAPE.search(raw):
+		return None
+	try:
+		path = unquote_to_bytes(raw).decode('utf-8')
+	except UnicodeDecodeError:
+		return None
+	return None if CONTROL.search(path) else path
+
+
+#http request parsed from its header block: the head is validated with one regex scan and split
+#into fields without per-line Python work; the body stays on the socket until a handler reads it.
+#Malformed requests don't raise, they are flagged with error = 400 for handle_request to answer
 class HTTPRequest:
-	def __init__(self, data, addr):
+	__slots__ = ('method', 'uri', 'path', 'raw_query', 'parsed_query', 'http_version', 'req_headers',
+		'req_line', 'req_body', 'client_ip', 'keep_alive', 'error', 'state')
+
+	def __init__(self, data, addr, body = None):
 		self.method = None
-		self.uri = None
-		self.http_version = '1.1'
-		self.req_body = None
-		self.req_headers = {}
-		self.req_line = None
+		self.uri = None # request target as sent, absolute-form reduced to its path
+		self.path = None # percent-decoded path of the target
+		self.raw_query = ''
+		self.parsed_query = None
+		self.http_version = None
+		self.req_headers = Headers()
+		self.req_line = ''
+		self.req_body = body # RequestBody stream, read by the handlers that need it
 		self.client_ip = addr[0]
+		self.keep_alive = True
+		self.error = None # status code when the request can't be parsed
+		self.state = None # server state (RuntimeState) the request is answered with, read once
 		self.parse(data)
-	
+
 	def parse(self, data):
-		try:
-			lines = data.decode('iso-8859-1').split('\r\n\r\n', 1)
-		except:
-			print('Data cant be decoded')
-			lines = str(data).split('\r\n\r\n', 1)
-		
-		head = lines[0].split('\r\n')
-		self.req_line = head[0]
-		if len(head) > 1:
-			self.req_headers = dict(i.split(': ') for i in head[1:])
-			# message-body signaled by inclusion of Content-Length or Transfer-Encoding header field in request headers.
-			if 'Content-Length' in self.req_headers.keys() or 'Transfer-Encoding' in self.req_headers.keys():
-				self.req_body = lines[1]
-		
-		self.parse_req(self.req_line)
-	
+		text = data.decode('iso-8859-1').rstrip('\r\n')
+		line_end = text.find('\r\n')
+		self.req_line = text if line_end == -1 else text[ : line_end]
+		if not self.parse_req(self.req_line):
+			self.error = 400
+			return
+		if line_end == -1:
+			return
+
+		block = text[line_end + 2 : ]
+		if not HEADER_BLOCK.fullmatch(block):
+			self.error = 400
+			return
+		pairs = [line.split(':', 1) for line in block.split('\r\n')]
+		fields = {name.lower(): value.strip(' \t') for name, value in pairs}
+		if len(fields) != len(pairs):
+			# a field was repeated, its values are combined in arrival order
+			fields = {}
+			for name, value in pairs:
+				name = name.lower()
+				value = value.strip(' \t')
+				if name in fields:
+					value = fields[name] + ('; ' if name == 'cookie' else ', ') + value
+				fields[name] = value
+		self.req_headers = Headers(fields)
+
+	# splits the request line, False if it is malformed
 	def parse_req(self, req_line):
-		words = req_line.split(' ')
-		if len(words) > 0:
-			self.method = words[0]
-		
-			if len(words) > 1:
-				abs_path = re.sub("^http://localhost:\d+", '', words[1])
-				self.uri = abs_path #the uri being requested
-
-				if len(words) > 2:
-					self.http_version = words[2]
\ No newline at end of file
+		match = REQUEST_LINE.fullmatch(req_line)
+		if match is None:
+			return False
+		self.method, target, self.http_version = match.groups()
+
+		if target.startswith(('http://', 'https://')):
+			# absolute-form: the authority is dropped, only the path is looked at
+			target = target[target.index('//') + 2 : ]
+			slash = target.find('/')
+			target = target[slash : ] if slash != -1 else '/'
+		elif not target.startswith('/') and not (target == '*' and self.method == 'OPTIONS'):
+			return False
+
+		raw_path, _, self.raw_query = target.partition('?')
+		self.path = percent_decode(raw_path)
+		if self.path is None:
+			return False
+		self.uri = target #the uri being requested
+		return True
+
+	# query string parameters, percent-decoded on first use: name -> [values]
+	@property
+	def query(self):
+		if self.parsed_query is None:
+			try:
+				self.parsed_query = parse_qs(self.raw_query, keep_blank_values = True)
+			except ValueError:
+				self.parsed_query = {}
+		return self.parsed_query
+
+	# the whole request body decoded to str, read off the socket only when a handler asks for it
+	def body_text(self, encoding = 'iso-8859-1'):
+		if self.req_body is None:
+			return None
+		return self.req_body.read().decode(encoding)
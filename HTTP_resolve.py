@@ -0,0 +1,214 @@
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+#where a request path resolved to: the real path of the file and, for lookups relative to an
+#open descriptor of its directory, that directory and the file's name in it. target is the
+#request path's own entry, the real path of its directory joined with its last segment: what a
+#write replaces or removes, so a symlink is acted on itself rather than the file it points to.
+#None when that directory lies outside the root
+class ResolvedPath:
+	__slots__ = ('path', 'filename', 'directory', 'name', 'target', 'checked')
+
+	def __init__(self, path, filename, directory, name, target, checked):
+		self.path = path # the request path this was resolved from
+		self.filename = filename
+		self.directory = directory
+		self.name = name
+		self.target = target
+		self.checked = checked # monotonic time of the realpath containment check
+
+
+#open descriptor of a directory, shared by the lookups under it; closed once it is evicted and
+#no lookup is using it any more
+class DirHandle:
+	__slots__ = ('fd', 'identity', 'checked', 'users', 'evicted')
+
+	def __init__(self, fd, identity, checked):
+		self.fd = fd
+		self.identity = identity # (st_dev, st_ino) of the directory the descriptor was opened on
+		self.checked = checked # monotonic time the path was last seen to lead to that directory
+		self.users = 0
+		self.evicted = False
+
+
+#maps request paths to files under the document root. '..' segments are resolved without ever
+#leaving the root and the result is confirmed with realpath, so neither traversal nor symlinks
+#reach outside it. Resolutions are kept in an LRU keyed by request path and re-checked every
+#revalidate_interval seconds; in between, files are looked up relative to open descriptors of
+#their directories (openat-style) instead of walking the whole path again, and any change to the
+#directory's entries is seen right away. A directory renamed or replaced is noticed when its
+#handle is revalidated, after at most revalidate_interval seconds
+class PathResolver:
+	def __init__(self, root, max_entries = 4096, max_dir_fds = 64, revalidate_interval = 1.0):
+		self.root = os.path.realpath(root or '.')
+		self.max_entries = max_entries
+		self.max_dir_fds = max_dir_fds
+		self.revalidate_interval = revalidate_interval
+		self.entries = OrderedDict() # request path -> ResolvedPath
+		self.dir_handles = OrderedDict() # directory -> DirHandle
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	# ResolvedPath of a percent-decoded request path, None if it points outside the root
+	def resolve(self, path):
+		now = time.monotonic()
+		with self.lock:
+			entry = self.entries.get(path)
+			if entry is not None and now - entry.checked < self.revalidate_interval:
+				self.entries.move_to_end(path)
+				self.hits += 1
+				return entry
+			self.misses += 1
+
+		entry = self.lookup(path, now)
+		if entry is not None and self.max_entries > 0:
+			with self.lock:
+				self.entries[path] = entry
+				self.entries.move_to_end(path)
+				while len(self.entries) > self.max_entries:
+					self.entries.popitem(last = False)
+		return entry
+
+	def lookup(self, path, now):
+		segments = []
+		for segment in path.split('/'):
+			if segment in ('', '.'):
+				continue
+			if segment == '..':
+				if not segments:
+					return None # climbing above the root
+				segments.pop()
+			else:
+				segments.append(segment)
+
+		try:
+			filename = os.path.realpath(os.path.join(self.root, *segments))
+			parent = os.path.realpath(os.path.join(self.root, *segments[:-1]))
+		except ValueError:
+			return None # embedded NUL, which the request parser already refuses
+		target = os.path.join(parent, *segments[-1:]) if self.contains(parent) else None
+		if filename == self.root:
+			return ResolvedPath(path, filename, filename, '.', target, now)
+		if not self.contains(filename):
+			return None # a symlink pointing outside the root
+		directory, name = os.path.split(filename)
+		return ResolvedPath(path, filename, directory, name, target, now)
+
+	def contains(self, filename):
+		return filename == self.root or filename.startswith(self.root + os.sep)
+
+	def acquire(self, directory):
+		now = time.monotonic()
+		with self.lock:
+			handle = self.dir_handles.get(directory)
+			if handle is not None and now - handle.checked < self.revalidate_interval:
+				self.dir_handles.move_to_end(directory)
+				handle.users += 1
+				return handle
+
+		if handle is not None:
+			# the descriptor still refers to the directory it was opened on, which may since have
+			# been moved away from this path (or out of the root) and replaced
+			try:
+				st = os.stat(directory)
+				current = (st.st_dev, st.st_ino) == handle.identity
+			except OSError:
+				current = False
+			with self.lock:
+				if self.dir_handles.get(directory) is handle:
+					if current:
+						handle.checked = now
+						self.dir_handles.move_to_end(directory)
+						handle.users += 1
+						return handle
+					self.evict(directory)
+
+		fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+		st = os.fstat(fd)
+		with self.lock:
+			handle = self.dir_handles.get(directory)
+			if handle is None or handle.identity != (st.st_dev, st.st_ino):
+				if handle is not None:
+					self.evict(directory)
+				handle = self.dir_handles[directory] = DirHandle(fd, (st.st_dev, st.st_ino), now)
+				while len(self.dir_handles) > self.max_dir_fds:
+					self.evict(next(iter(self.dir_handles)))
+			else:
+				os.close(fd) # another thread opened it meanwhile
+			handle.users += 1
+			return handle
+
+	def release(self, handle):
+		with self.lock:
+			handle.users -= 1
+			if handle.evicted and handle.users == 0:
+				os.close(handle.fd)
+
+	def evict(self, directory):
+		handle = self.dir_handles.pop(directory)
+		handle.evicted = True
+		if handle.users == 0:
+			os.close(handle.fd)
+
+	# stat result of a resolved file looked up in its directory, None if it doesn't exist or
+	# was replaced by a symlink since it was resolved
+	def stat(self, entry):
+		try:
+			handle = self.acquire(entry.directory)
+		except OSError:
+			return None
+		try:
+			st = os.stat(entry.name, dir_fd = handle.fd, follow_symlinks = False)
+		except OSError:
+			return None
+		finally:
+			self.release(handle)
+		if stat.S_ISLNK(st.st_mode):
+			self.forget(entry.path)
+			return None
+		return st
+
+	def access(self, entry, mode):
+		try:
+			handle = self.acquire(entry.directory)
+		except OSError:
+			return False
+		try:
+			return os.access(entry.name, mode, dir_fd = handle.fd)
+		finally:
+			self.release(handle)
+
+	# binary file object of a resolved file, opened in the directory its lookups go through
+	# (without following a symlink swapped in for it), so the file served is the one that was
+	# checked. OSError when it can't be opened
+	def open(self, entry):
+		handle = self.acquire(entry.directory)
+		try:
+			fd = os.open(entry.name, os.O_RDONLY | os.O_NOFOLLOW, dir_fd = handle.fd)
+		finally:
+			self.release(handle)
+		return os.fdopen(fd, 'rb')
+
+	def forget(self, path):
+		with self.lock:
+			self.entries.pop(path, None)
+
+	# dropping what we know about a file (or everything under a directory) we modified ourselves
+	def invalidate(self, filename):
+		prefix = filename.rstrip(os.sep) + os.sep
+		with self.lock:
+			for path, entry in list(self.entries.items()):
+				if entry.filename == filename or entry.filename.startswith(prefix):
+					del self.entries[path]
+			for directory in [d for d in self.dir_handles if d == filename or d.startswith(prefix)]:
+				self.evict(directory)
+
+	def close(self):
+		with self.lock:
+			for directory in list(self.dir_handles):
+				self.evict(directory)
+			self.entries.clear()
@@ -0,0 +1,101 @@
+import os
+import time
+from email.utils import formatdate
+from HTTP_mmap import MappedBody
+
+# most buffers a single sendmsg accepts (the usual IOV_MAX)
+IOV_MAX = 1024
+
+#response body served straight from an open file instead of a bytes copy: sent with the kernel's
+#sendfile where the socket supports it and in fixed-size chunks otherwise, so memory stays
+#flat whatever the file size
+class FileBody:
+	def __init__(self, file, offset = 0, count = None):
+		self.file = file
+		self.offset = offset
+		self.count = os.fstat(file.fileno()).st_size - offset if count is None else count
+
+	# socket.sendfile uses os.sendfile and falls back to chunked send() itself
+	def send(self, sock):
+		try:
+			if self.count:
+				sock.sendfile(self.file, self.offset, self.count)
+		finally:
+			self.close()
+
+	def close(self):
+		self.file.close()
+
+
+#response built by a handler for one request: status, entity header fields and body. Each
+#request gets its own, so concurrent handlers never share response state. The body is bytes,
+#a FileBody, a MappedBody, a list of those or None; content_length is what the Content-Length
+#field announces, which differs from the body for HEAD and must be given for non-bytes bodies
+class Response:
+	__slots__ = ('status_code', 'body', 'content_type', 'content_length', 'headers')
+
+	def __init__(self, status_code, body = None, content_type = None, content_length = None, headers = None):
+		self.status_code = status_code
+		self.body = body
+		self.content_type = content_type
+		if content_length is None:
+			content_length = len(body) if body is not None else 0
+		self.content_length = content_length
+		self.headers = {} if headers is None else headers # extra header fields, name -> value
+
+
+#Date header field, formatted at most once per second and kept preencoded
+class HeaderDate:
+	def __init__(self):
+		self.cached = (None, None) # (second, header bytes), swapped as one tuple so no lock is needed
+
+	def now(self):
+		second = int(time.time())
+		cached_second, header = self.cached
+		if cached_second != second:
+			header = f'Date: {formatdate(second, localtime=False, usegmt=True)}\r\n'.encode('ascii')
+			self.cached = (second, header)
+		return header
+
+
+# writes the buffers with as few syscalls as possible: one sendmsg (writev) for all of them,
+# repeated only for what a partial write left over (and, for very long lists, per IOV_MAX buffers)
+def send_buffers(sock, buffers):
+	buffers = [memoryview(buffer) for buffer in buffers if buffer]
+	if not hasattr(sock, 'sendmsg'):
+		for buffer in buffers:
+			sock.sendall(buffer)
+		return
+
+	while buffers:
+		sent = sock.sendmsg(buffers[ : IOV_MAX])
+		while sent:
+			if sent >= len(buffers[0]):
+				sent -= len(buffers.pop(0))
+			else:
+				buffers[0] = buffers[0][sent : ]
+				sent = 0
+
+
+# writes a response head and its body to a blocking socket; the body is bytes, a FileBody,
+# a MappedBody, a list of those (multipart responses) or None. The head goes out in the same
+# writev as the bytes (and mapped views) that follow it
+def send_response(sock, response, message):
+	parts = message if isinstance(message, list) else [message]
+	buffers = [response]
+	try:
+		for part in parts:
+			if isinstance(part, FileBody):
+				send_buffers(sock, buffers)
+				buffers = []
+				part.send(sock)
+			elif isinstance(part, MappedBody):
+				buffers.append(part.view)
+			elif part:
+				buffers.append(part)
+		send_buffers(sock, buffers)
+	finally:
+		buffers = None
+		for part in parts:
+			if isinstance(part, MappedBody):
+				part.close()
@@ -0,0 +1,53 @@
+import functools
+
+#one path segment of the routing trie
+class RouteNode:
+	__slots__ = ('children', 'handlers', 'fallback')
+
+	def __init__(self):
+		self.children = {} # path segment -> RouteNode
+		self.handlers = {} # method -> handler callable
+		self.fallback = None # 405 handler with this node's Allow header bound in
+
+
+#method and path-prefix dispatch table, built once at startup: a request is matched against
+#the longest registered prefix (walked segment by segment through a trie), then the method is
+#looked up in that prefix's handler dict. Handlers are callables taking the request and
+#returning a Response
+class Router:
+	def __init__(self, not_implemented, method_not_allowed):
+		self.root = RouteNode()
+		self.methods = set() # every method some route handles
+		self.not_implemented = not_implemented # handler(req) for unknown methods (501)
+		self.method_not_allowed = method_not_allowed # handler(req, allow) for 405
+
+	def add(self, method, prefix, handler):
+		node = self.root
+		for segment in prefix.strip('/').split('/'):
+			if segment:
+				node = node.children.setdefault(segment, RouteNode())
+		node.handlers[method] = handler
+		self.methods.add(method)
+		# the 405 answer for this prefix is prepared here, not per request
+		node.fallback = functools.partial(self.method_not_allowed, allow = ', '.join(sorted(node.handlers)))
+
+	# handler for a request: the route's own, 405 when the prefix doesn't take the method,
+	# 501 when no route does
+	def resolve(self, method, path):
+		if method not in self.methods:
+			return self.not_implemented
+
+		node = self.root
+		match = node if node.handlers else None
+		for segment in path.split('/'):
+			if not segment:
+				continue
+			node = node.children.get(segment)
+			if node is None:
+				break
+			if node.handlers:
+				match = node
+
+		if match is None:
+			return self.not_implemented
+		return match.handlers.get(method, match.fallback)
@@ -1,41 +1,81 @@
 import socket
 import os
 import shutil
+import tempfile
 import datetime
-import tzlocal
 from uuid import uuid4
 import re
 import time
 from http import HTTPStatus
-from email.utils import formatdate
+from email.utils import formatdate, parsedate_to_datetime
 from TCP_Server import TCPServer
+from HTTP_reader import RECV_SIZE
 from HTTP_request import HTTPRequest
+from HTTP_response import Response, FileBody, HeaderDate
+from HTTP_cache import CacheEntry, stat_validator
+from HTTP_mmap import MappedBody
+from HTTP_autoindex import render_page
+from HTTP_log import LogWriter, LogTimestamp
+from HTTP_router import Router
+from HTTP_metrics import PHASE_PARSE, PHASE_HANDLER
+from HTTP_config import load_config, ConfigError, ConfigWatcher, SCHEMA, RELOAD, RESTART
+from HTTP_state import RuntimeState
+from stat import S_ISDIR, S_ISREG
+from HTTP_multipart import MultipartReader, header_params
+import signal
+import threading
 import mimetypes
+import zlib
+import hashlib
+import functools
+from urllib.parse import quote
 
 mimetypes.add_type('application/vnd.openxmlformats-officedocument.wordprocessingml.document', '.docx', strict=True)
 
 COOKIE_LOG = '/logs/CookieLog'
 CONFIG = 'httpserver.config'
+# file mode of newly uploaded files, read once since os.umask can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+STATIC_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE')
+# content types worth gzip-encoding, and the smallest body worth the trouble
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json', 'application/xml', 'application/xhtml+xml', 'image/svg+xml')
+GZIP_MIN_SIZE = 256
+# ranges accepted in one request before the Range header is ignored
+MAX_RANGES = 16
+
+
+# HTTP-date of a conditional request header as epoch seconds, None if it can't be parsed;
+# clients repeat the same few dates, so the parsed values are cached
+@functools.lru_cache(maxsize = 1024)
+def parse_http_date(value):
+	try:
+		return int(parsedate_to_datetime(value).timestamp())
+	except (TypeError, ValueError, IndexError):
+		return None
 
 #Now teaching the HTTP protocol to use TCP server
 class HTTPServer(TCPServer):
 	def __init__(self):
 		super().__init__()
-		self.res_body_len = 0
-		self.file_type = None
-		self.headers = {
-			'Date' : None,
-			'Server' : 'httpserver',
-			'Content-Length' : None,
-			'Content-Type' : None
-		}
-
-		self.config = self.handle_config()
-		self.documentRoot = self.handle_document_root()
-		self.max_active_connections = self.handle_active_connections()
+		self.reload_lock = threading.Lock() # serializes reloads, never taken by requests
+		self.header_date = HeaderDate()
+
 		self.status_codes = {}
-		self.log_file_locations = {}
-		self.handle_log_file_locations()
+		self.log_time = LogTimestamp()
+		self.log_writer = LogWriter()
+		self.apply_config()
+
+		# dispatch table: the static file handlers own every path not mounted elsewhere
+		self.router = Router(self.http_501_handler, self.http_405_handler)
+		for method in STATIC_METHODS:
+			self.router.add(method, '/', getattr(self, f'handle_{method}'))
+		metrics_path = self.state.metrics_path
+		if metrics_path:
+			# reserved path answered from the metrics registry instead of the document root
+			self.router.add('GET', metrics_path, self.handle_metrics)
+			self.router.add('HEAD', metrics_path, self.handle_metrics)
+		self.describe_metrics()
 	
 		for stat in HTTPStatus:
 			name = stat.name
@@ -43,6 +83,61 @@ class HTTPServer(TCPServer):
 			val = stat.value
 			self.status_codes[val] = (name, desc)
 
+		# preencoded status lines and canned error pages, built once
+		self.status_lines = {}
+		self.error_pages = {}
+		for val, (name, desc) in self.status_codes.items():
+			self.status_lines[val] = f'HTTP/1.1 {val} {name}\r\n'.encode('ascii')
+			if val >= 400:
+				self.error_pages[val] = f"<h1>{val} {desc}</h1>\r\n".encode('ascii')
+		self.error_pages[401] = b"<h1>401 Unauthorized</h1>"
+		self.error_pages[404] = b"<h1>404 Not Found</h1>"
+		self.error_pages[501] = b"<h1>501 Not Implemented</h1>"
+		self.error_pages[505] = b"<h1>505 HTTP Version Not Supported</h1>"
+
+	# (re)reads httpserver.config and applies it. At startup invalid lines are reported and left out;
+	# a reload with any problem keeps the running configuration. The new RuntimeState is built in
+	# full and published with one assignment; requests in flight keep the state they started with
+	def apply_config(self, reload = False):
+		with self.reload_lock:
+			try:
+				config, errors = self.handle_config()
+			except ConfigError as e:
+				if not reload:
+					raise
+				print(f'Configuration not reloaded: {e}')
+				return False
+			for error in errors:
+				print(f'Invalid config: {error}')
+			if errors and reload:
+				print('Configuration not reloaded, the running configuration is kept')
+				return False
+
+			previous = self.state
+			if previous is not None:
+				# a single process can't resize its pool or rebind its socket; the pre-fork
+				# supervisor applies those by replacing its workers
+				pending = [name for name in config.changed(previous.config) if SCHEMA[name].applies == RESTART
+					or (SCHEMA[name].applies != RELOAD and previous.worker_processes == 1)]
+				for name in pending:
+					print(f'{name} changed, takes effect after a restart')
+				config = config.replace({name: previous.config[name] for name in pending})
+
+			state = RuntimeState(config, previous)
+			self.state = state
+			self.profiler.settings = state.profile
+			self.log_writer.limits = state.log_limits
+
+			if previous is not None:
+				state.release(previous)
+				if state.profile_mode != previous.profile_mode:
+					# a running profile keeps its settings; a new mode starts a new run
+					self.profiler.stop()
+					if state.profile_mode != 'off':
+						self.profiler.start()
+				print('Configuration reloaded')
+			return True
+
 
 	# returns byte length of a string
 	def clen(self, s):
@@ -54,40 +149,11 @@ class HTTPServer(TCPServer):
 
 	
 
-	def handle_log_file_locations(self):
-		if self.config.get('ErrorLog'):
-			self.log_file_locations['errorlog'] = self.config['ErrorLog']
-		else:
-			self.log_file_locations['errorlog'] = 'logs/error.log'
-
-		if self.config.get('AccessLog'):
-			self.log_file_locations['accesslog'] = self.config['AccessLog']
-		else:
-			self.log_file_locations['accesslog'] = 'logs/access.log'
-
-
-	def handle_active_connections(self):
-		if self.config.get('MaxActiveConn'):
-			n = self.config.get('MaxActiveConn')
-
-			if n > 1:
-				return n
-		return 100 #default max value
-
-	def handle_document_root(self):
-		if self.config.get('DocumentRoot'):
-			docRoot = self.config['DocumentRoot'].strip("/")
-			if os.path.exists(docRoot):
-				return docRoot
-			else:
-				print("DocumentRoot Error: OS Path does not exist")
-		return ""
-
-	def handle_cookies(self):
+	def handle_cookies(self, state):
 		headers = ""
 
-		if self.config.get('CookieName'):
-			for cookie in self.config['CookieName']:
+		if state.cookies:
+			for cookie in state.cookies:
 				if cookie[-1] != ';':
 					headers += f'Set-Cookie: {cookie}={str(uuid4()).replace("-", "")}\r\n'
 				else:
@@ -97,169 +163,520 @@ class HTTPServer(TCPServer):
 		
 		return headers
 		
-	def handle_request(self, data, addr):
-		req = HTTPRequest(data, addr)
-		version = req.http_version.split('/')[1]
-		if version != '1.1':
+	# the process owning the configuration watches its file (ConfigWatchInterval): the pre-fork
+	# supervisor, which replaces its workers on SIGHUP (its handler only flags the reload for the
+	# supervisor's main loop, so signalling it from the watcher thread is safe), or the single
+	# server process
+	def start(self):
+		if self.state.worker_processes > 1:
+			reload = lambda: os.kill(os.getpid(), signal.SIGHUP)
+		else:
+			reload = self.reload
+		ConfigWatcher(CONFIG, lambda: self.state.config['ConfigWatchInterval'], reload).start()
+		super().start()
+
+	# SIGHUP (or a change of the config file) reopens the log files, for logrotate, and reloads the
+	# configuration; on its own thread since reading and checking the file does I/O
+	def reload(self, signum = None, frame = None):
+		self.log_writer.reopen()
+		threading.Thread(target = self.apply_config, args = (True,)).start()
+
+	# runs the accept loop; SIGHUP reloads the configuration (in a pre-fork worker, whose
+	# configuration comes from the supervisor, it only reopens the log files), SIGUSR1 switches
+	# request profiling on and off. Queued log lines and a running profile are written out before
+	# the process exits
+	def serve(self):
+		if self.state.worker_processes > 1:
+			# each pre-fork worker keeps its own registry and a scrape is answered by whichever
+			# worker accepted it: the label keeps the workers' series apart
+			self.metrics.labels = (('worker', str(os.getpid())),)
+		if threading.current_thread() is threading.main_thread():
+			signal.signal(signal.SIGHUP, self.reload if self.state.worker_processes == 1 else self.log_writer.reopen)
+			signal.signal(signal.SIGUSR1, self.profiler.toggle)
+		if self.state.profile_mode != 'off':
+			self.profiler.start()
+		try:
+			super().serve()
+		finally:
+			self.profiler.stop()
+			self.log_writer.close()
+
+	# mounts a handler callable for method on a URI prefix, e.g. an API next to the static files;
+	# the handler takes the request and returns a Response like the handle_* methods
+	def add_route(self, method, prefix, handler):
+		self.router.add(method, prefix, handler)
+
+	# persistent connections are the HTTP/1.1 default unless the client sends Connection: close
+	def wants_keep_alive(self, req):
+		tokens = req.req_headers.get('Connection', '').split(',')
+		return 'close' not in [token.strip().lower() for token in tokens]
+
+	def handle_request(self, data, addr, keep_alive = True, body = None):
+		started = time.perf_counter()
+		req = HTTPRequest(data, addr, body)
+		req.state = self.state
+		parsed = time.perf_counter()
+		req.keep_alive = keep_alive and self.wants_keep_alive(req)
+		if req.error:
+			req.keep_alive = False
+			handler = self.http_400_handler
+		elif req.http_version != 'HTTP/1.1':
+			req.keep_alive = False
 			handler = self.http_505_handler
 		else:
-			try:
-				handler = getattr(self, f'handle_{req.method}')
-				if req.uri == None:
-					handler = self.http_400_handler
-	
-			except AttributeError:
-				handler = self.http_501_handler
-
-		response, message = handler(req)
-
-		return response, message
+			handler = self.router.resolve(req.method, req.path)
+
+		res = handler(req)
+		# a client still waiting for 100 Continue never sends the body, it can't be drained
+		if body is not None and body.continue_pending:
+			req.keep_alive = False
+		response_head = self.response_head(req, res)
+
+		done = time.perf_counter()
+		self.metrics.observe('http_phase_seconds', PHASE_PARSE, parsed - started)
+		self.metrics.observe('http_phase_seconds', PHASE_HANDLER, done - parsed)
+		if self.profiler.enabled:
+			self.profiler.phase('parse', parsed - started)
+			self.profiler.phase('handler', done - parsed)
+		self.record_response(req, res, response_head, done - started)
+
+		return response_head, res.body, req.keep_alive
+
+	# answers a request that could not be read off the socket; the connection is closed after it
+	def handle_error(self, status_code, addr, extra_headers = {}):
+		req = HTTPRequest(b'', addr)
+		req.state = self.state
+		req.keep_alive = False
+		res = self.http_error_handler(req, status_code, extra_headers)
+		response_head = self.response_head(req, res)
+		self.record_response(req, res, response_head)
+		return response_head, res.body, False
+
+	# registers the metrics recorded by HTTPServer and the ones read from its components
+	def describe_metrics(self):
+		metrics = self.metrics
+		metrics.describe('http_requests_total', 'counter', 'Requests answered, by method and status.')
+		metrics.describe('http_request_duration_seconds', 'histogram', 'Time from parsing a request to having its response ready, by method.')
+		metrics.describe('http_sent_bytes_total', 'counter', 'Response bytes sent, head and body.')
+		metrics.gauge('http_file_cache_hits_total', 'Static file bodies served from the cache.', lambda: self.state.file_cache.hits, 'counter')
+		metrics.gauge('http_file_cache_misses_total', 'Static file bodies read from disk.', lambda: self.state.file_cache.misses, 'counter')
+		metrics.gauge('http_file_cache_evictions_total', 'Entries evicted from the static file cache.', lambda: self.state.file_cache.evictions, 'counter')
+		metrics.gauge('http_file_cache_entries', 'Entries in the static file cache.', lambda: len(self.state.file_cache.entries))
+		metrics.gauge('http_file_cache_bytes', 'Body bytes held by the static file cache.', lambda: self.state.file_cache.size)
+		metrics.gauge('http_file_cache_hit_ratio', 'Share of static file bodies served from the cache.', self.file_cache_hit_ratio)
+		metrics.gauge('http_mmap_hits_total', 'Static file bodies sent from an existing mapping.', lambda: self.state.mmap_pool.hits, 'counter')
+		metrics.gauge('http_mmap_maps_total', 'Static files mapped into memory.', lambda: self.state.mmap_pool.maps, 'counter')
+		metrics.gauge('http_mmap_entries', 'Files mapped by the mmap pool.', lambda: len(self.state.mmap_pool.entries))
+		metrics.gauge('http_mmap_bytes', 'Bytes mapped by the mmap pool.', lambda: self.state.mmap_pool.size)
+		metrics.gauge('http_listing_cache_hits_total', 'Directory listings served from the listing cache.', lambda: self.state.listing_cache.hits, 'counter')
+		metrics.gauge('http_listing_cache_misses_total', 'Directories scanned for a listing.', lambda: self.state.listing_cache.misses, 'counter')
+		metrics.gauge('http_path_cache_hits_total', 'Request paths resolved from the path cache.', lambda: self.state.resolver.hits, 'counter')
+		metrics.gauge('http_path_cache_misses_total', 'Request paths resolved with a realpath check.', lambda: self.state.resolver.misses, 'counter')
+		metrics.gauge('http_log_dropped_lines_total', 'Log lines dropped because the log queue was full.', lambda: self.log_writer.dropped, 'counter')
+
+	def file_cache_hit_ratio(self):
+		file_cache = self.state.file_cache
+		lookups = file_cache.hits + file_cache.misses
+		return file_cache.hits / lookups if lookups else 0.0
+
+	# counts a response by method and status; unknown methods share one label so clients can't
+	# blow up the number of series
+	def record_response(self, req, res, response_head, duration = None):
+		method = req.method if req.method in self.router.methods else 'OTHER'
+		self.metrics.inc('http_requests_total', (('method', method), ('status', str(res.status_code))))
+		self.metrics.inc('http_sent_bytes_total', value = len(response_head) + (res.content_length if res.body is not None else 0))
+		if duration is not None:
+			self.metrics.observe('http_request_duration_seconds', (('method', method),), duration)
+
+	# the metrics registry in the Prometheus text format, served on MetricsPath
+	def handle_metrics(self, req):
+		body = self.metrics.render()
+		res = Response(200, body if req.method == 'GET' else None, 'text/plain; version=0.0.4; charset=utf-8', len(body))
+		self.access_log(req, res)
+		return res
+
+	def http_error_handler(self, req, status_code, extra_headers = {}):
+		self.error_log(req, status_code)
+		return Response(status_code, self.error_pages[status_code], 'text/html', headers = dict(extra_headers))
+
+	def http_405_handler(self, req, allow):
+		return self.http_error_handler(req, 405, {'Allow': allow})
 
 	def http_400_handler(self, req):
-		response_line = self.response_line(status_code=400)
-
-		res_body = f"<h1>400 {self.status_codes[400][1]}</h1>\r\n"
-
-		# getting content length of HTTP response body
-		self.res_body_len = self.clen(res_body)
-
-		self.file_type = 'text/html'
-		response_headers = self.response_headers(req)
-		blank_line = '\r\n'
-		self.error_log(req, response_line)
-
-		return f'{response_line}{response_headers}{blank_line}', res_body.encode('ascii')
+		return self.http_error_handler(req, 400)
 
 	def http_505_handler(self, req):
-		response_line = self.response_line(status_code=505)
-
-		res_body = "<h1>505 HTTP Version Not Supported</h1>"
-
-		# getting content length of HTTP response body
-		self.res_body_len = self.clen(res_body)
-
-		self.file_type = 'text/html'
-		response_headers = self.response_headers(req)
-		blank_line = '\r\n'
-		self.error_log(req, response_line)
-
-		return f'{response_line}{response_headers}{blank_line}', res_body.encode('ascii')
+		return self.http_error_handler(req, 505)
 	
 	def http_501_handler(self, req):
-		response_line = self.response_line(status_code=501)
-
-		res_body = "<h1>501 Not Implemented</h1>"
-
-		# getting content length of HTTP response body
-		self.res_body_len = self.clen(res_body)
-
-		self.file_type = 'text/html'
-		response_headers = self.response_headers(req)
-		blank_line = '\r\n'
-		self.error_log(req, response_line)
-
-		return f'{response_line}{response_headers}{blank_line}', res_body.encode('ascii')
+		return self.http_error_handler(req, 501)
 
 	
-	def get_last_modified_time(self, filename):
-		filetime = os.path.getmtime(filename)
-		s = time.ctime(filetime).split()
-		filetime = f'{s[0]}, {s[2]} {s[1]} {s[4]} {s[3]} GMT'	
-		return filetime
-
-	def if_modified_since_handler(self, giventime, filetime):
-		f1 = datetime.datetime.strptime(filetime, '%a, %d %b %Y %H:%M:%S GMT')
-		g1 = datetime.datetime.strptime(giventime, '%a, %d %b %Y %H:%M:%S GMT')
-		if f1 > g1:
-			return True, filetime
+	# stat result of a static file, None if it doesn't exist; the single source of its size,
+	# modification time and existence for GET, HEAD and the conditional-request checks
+	def stat_file(self, filename):
+		try:
+			return os.stat(filename)
+		except OSError:
+			return None
+
+	def get_last_modified_time(self, st):
+		return formatdate(st.st_mtime, localtime=False, usegmt=True)
+
+	# cache entry of a resolved static file from the file cache of state, built on a miss
+	def cache_entry(self, state, resolved, st):
+		return state.file_cache.lookup(resolved.filename, st, functools.partial(self.build_cache_entry, state, resolved))
+
+	# everything about a static file that only changes with the file, cached per path
+	def build_cache_entry(self, state, resolved, filename, st):
+		validator = stat_validator(st)
+		if state.etag_content_hash and st.st_size <= state.file_cache.max_file_size:
+			with state.resolver.open(resolved) as f:
+				etag = '"%s"' % hashlib.sha1(f.read()).hexdigest()
 		else:
-			return False, giventime
-
-	def if_unmodified_since_handler(self, giventime, filetime):
-		f1 = datetime.datetime.strptime(filetime, '%a, %d %b %Y %H:%M:%S GMT')
-		g1 = datetime.datetime.strptime(giventime, '%a, %d %b %Y %H:%M:%S GMT')
-		if f1 < g1:
-			return True, filetime
+			etag = '"%x-%x-%x"' % validator
+		return CacheEntry(validator, self.ctype(filename), self.get_last_modified_time(st), etag)
+
+	# whether an If-Match / If-None-Match list contains etag; If-Match uses the strong
+	# comparison (weak tags never match), If-None-Match the weak one
+	def etag_matches(self, value, etag, weak):
+		if value.strip() == '*':
+			return True
+		for tag in value.split(','):
+			tag = tag.strip()
+			if tag.startswith('W/'):
+				if not weak:
+					continue
+				tag = tag[2 : ]
+			if tag == etag:
+				return True
+		return False
+
+	# evaluates the conditional request headers in RFC 9110 order against the validators of the
+	# selected representation, returns 304 or 412 when the request shouldn't be answered with
+	# it, None otherwise
+	def check_preconditions(self, req, etag, entry):
+		headers = req.req_headers
+		mtime = entry.validator[2] // 1000000000
+
+		if 'If-Match' in headers:
+			if not self.etag_matches(headers['If-Match'], etag, weak = False):
+				return 412
+		elif 'If-Unmodified-Since' in headers:
+			since = parse_http_date(headers['If-Unmodified-Since'])
+			if since is not None and mtime > since:
+				return 412
+
+		if 'If-None-Match' in headers:
+			if self.etag_matches(headers['If-None-Match'], etag, weak = True):
+				return 304 if req.method in ('GET', 'HEAD') else 412
+		elif 'If-Modified-Since' in headers and req.method in ('GET', 'HEAD'):
+			since = parse_http_date(headers['If-Modified-Since'])
+			if since is not None and mtime <= since:
+				return 304
+
+		return None
+
+	# preconditions of a PUT or DELETE, evaluated against the file as it is now, before any of the
+	# body is read or anything changed: 412 when they fail, None otherwise. A missing file has no
+	# representation for If-Match to match, not even *; a directory has no validators, only the
+	# existence checks of * apply to it
+	def check_write_preconditions(self, req, resolved, st):
+		headers = req.req_headers
+		if st is None:
+			return 412 if 'If-Match' in headers else None
+		if S_ISDIR(st.st_mode):
+			if 'If-Match' in headers and headers['If-Match'].strip() != '*':
+				return 412
+			if headers.get('If-None-Match', '').strip() == '*':
+				return 412
+			return None
+		entry = self.cache_entry(req.state, resolved, st)
+		return self.check_preconditions(req, entry.etag, entry)
+
+	def compressible(self, content_type):
+		return content_type is not None and (content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES)
+
+	# whether the client's Accept-Encoding allows a gzip-coded response
+	def accepts_gzip(self, req):
+		for coding in req.req_headers.get('Accept-Encoding', '').split(','):
+			name, _, params = coding.partition(';')
+			if name.strip().lower() in ('gzip', 'x-gzip', '*'):
+				q = params.strip()
+				try:
+					return not q.startswith('q=') or float(q[2 : ]) > 0
+				except ValueError:
+					return False
+		return False
+
+	# gzip variant of a static file as (body, length, etag): a precompressed sibling .gz file when it
+	# is at least as new as the file, otherwise the file compressed once and kept in its cache
+	# entry. None when there is no variant worth sending. The sibling is resolved like a request
+	# for it, so a .gz symlink can't reach outside the document root
+	def gzip_variant(self, state, resolved, st, entry):
+		file_cache = state.file_cache
+		filename = resolved.filename
+		gz = state.resolver.resolve(resolved.path + '.gz')
+		gz_st = state.resolver.stat(gz) if gz is not None else None
+		if (gz_st is not None and S_ISREG(gz_st.st_mode) and gz_st.st_mtime >= st.st_mtime
+				and state.resolver.access(gz, os.R_OK)):
+			gz_entry = self.cache_entry(state, gz, gz_st)
+			gz_body = file_cache.body(gz.filename, gz_entry, lambda: state.resolver.open(gz))
+			if gz_body is None:
+				gz_body = FileBody(state.resolver.open(gz), 0, gz_st.st_size)
+			return gz_body, gz_st.st_size, gz_entry.etag
+
+		if entry.gzip is None:
+			if st.st_size < GZIP_MIN_SIZE:
+				return None
+			res_body = file_cache.body(filename, entry, lambda: state.resolver.open(resolved))
+			if res_body is None:
+				return None # too big to compress on every request
+			compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits 31: gzip container
+			data = compressor.compress(res_body) + compressor.flush()
+			file_cache.store_gzip(filename, entry, data if len(data) < len(res_body) else False)
+			if len(data) >= len(res_body):
+				return None
+			return data, len(data), self.gzip_etag(entry)
+
+		if entry.gzip:
+			return entry.gzip, len(entry.gzip), self.gzip_etag(entry)
+		return None
+
+	# each representation needs its own strong validator
+	def gzip_etag(self, entry):
+		return entry.etag[ : -1] + '-gzip"'
+
+	# byte ranges asked for by a Range header as (first, last) offsets clipped to size; None when
+	# the header should be ignored and the full file sent, [] when no range is satisfiable
+	def parse_ranges(self, value, size):
+		unit, _, spec = value.partition('=')
+		if unit.strip().lower() != 'bytes':
+			return None
+		specs = spec.split(',')
+		if len(specs) > MAX_RANGES:
+			return None
+
+		ranges = []
+		for spec in specs:
+			first, dash, last = spec.strip().partition('-')
+			try:
+				if not dash:
+					return None
+				if first == '':
+					# suffix range: the last n bytes
+					n = int(last)
+					if n > 0 and size > 0:
+						ranges.append((max(size - n, 0), size - 1))
+					continue
+				first = int(first)
+				last = int(last) if last != '' else first + size # open-ended: to the end of the file
+			except ValueError:
+				return None
+			if first < 0 or last < first:
+				return None
+			if first < size:
+				ranges.append((first, min(last, size - 1)))
+		return ranges
+
+	# If-Range: the range only applies while the client's validator still matches the file
+	def if_range_matches(self, req, entry):
+		value = req.req_headers.get('If-Range')
+		if value is None:
+			return True
+		if value.startswith('"'):
+			return value == entry.etag
+		return value == entry.last_modified
+
+	# 206 Partial Content for one range, multipart/byteranges for several, 416 when none can be
+	# satisfied. Parts are sliced out of the cached body or the file's mapping, or sent with
+	# sendfile from their offsets
+	def range_response(self, req, resolved, st, entry, ranges, extra_headers):
+		filename = resolved.filename
+		open_file = lambda: req.state.resolver.open(resolved)
+		size = st.st_size
+		if not ranges:
+			self.error_log(req, 416)
+			res = Response(416, headers = {'Content-Range': f'bytes */{size}'})
+			self.access_log(req, res)
+			return res
+
+		mmap_pool = req.state.mmap_pool
+		cached = req.state.file_cache.body(filename, entry, open_file)
+		mapped = mmap_pool.acquire(filename, st, open_file) if cached is None else None
+		def part(first, last):
+			if cached is not None:
+				return memoryview(cached)[first : last + 1]
+			if mapped is not None:
+				return MappedBody(mmap_pool, mapped, first, last - first + 1)
+			return FileBody(open_file(), first, last - first + 1)
+
+		if len(ranges) == 1:
+			first, last = ranges[0]
+			extra_headers['Content-Range'] = f'bytes {first}-{last}/{size}'
+			res = Response(206, part(first, last), entry.content_type, last - first + 1, extra_headers)
 		else:
-			return False, giventime
-	
-	def handle_GET(self, req):
-		filename = req.uri.strip('/')
-		filename = os.path.join(self.documentRoot, filename) if filename != '' else filename
-		blank_line = '\r\n'
-
-		if os.path.exists(filename):
-			if os.access(filename, os.R_OK):
-				response_line = self.response_line(200)
-			
-				with open(filename, 'rb') as f:
-					res_body = f.read()
-
-				# getting content type of filename
-				self.file_type = self.ctype(filename)
+			boundary = uuid4().hex
+			res_body = []
+			res_body_len = 0
+			for first, last in ranges:
+				part_head = (f'\r\n--{boundary}\r\nContent-Type: {entry.content_type}\r\n'
+					f'Content-Range: bytes {first}-{last}/{size}\r\n\r\n').encode('ascii')
+				res_body += [part_head, part(first, last)]
+				res_body_len += len(part_head) + last - first + 1
+			closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+			res_body.append(closing)
+			res_body_len += len(closing)
+			res = Response(206, res_body, f'multipart/byteranges; boundary={boundary}', res_body_len, extra_headers)
+		if mapped is not None:
+			mmap_pool.release(mapped) # the parts hold their own references
+
+		self.access_log(req, res)
+		return res
+
+	# response for a static file built from its stat result and cache entry, shared by GET and
+	# HEAD (which gets the same headers without the body)
+	def static_file_response(self, req, resolved, st, send_body = True):
+		filename = resolved.filename
+		state = req.state
+		entry = self.cache_entry(state, resolved, st)
+		extra_headers = {'Last-Modified': entry.last_modified, 'ETag': entry.etag, 'Accept-Ranges': 'bytes'}
+		res_body = None
+		# content length is the size of the file, also in HEAD where the body isn't sent
+		res_body_len = st.st_size
+
+		# selecting the representation first: preconditions are evaluated against its validators.
+		# byte ranges are served from the identity representation, GET only
+		use_range = send_body and 'Range' in req.req_headers
+		if self.compressible(entry.content_type):
+			extra_headers['Vary'] = 'Accept-Encoding'
+			variant = self.gzip_variant(state, resolved, st, entry) if self.accepts_gzip(req) and not use_range else None
+			if variant is not None:
+				res_body, res_body_len, extra_headers['ETag'] = variant
+				extra_headers['Content-Encoding'] = 'gzip'
+
+		status_code = self.check_preconditions(req, extra_headers['ETag'], entry)
+		if status_code:
+			if isinstance(res_body, FileBody):
+				res_body.close()
+			validators = {'ETag': extra_headers['ETag']}
+			if 'Vary' in extra_headers:
+				validators['Vary'] = extra_headers['Vary']
+			res = Response(status_code, headers = validators)
+			self.access_log(req, res)
+			return res
+
+		if use_range and self.if_range_matches(req, entry):
+			ranges = self.parse_ranges(req.req_headers['Range'], st.st_size)
+			if ranges is not None:
+				return self.range_response(req, resolved, st, entry, ranges, extra_headers)
+
+		if send_body and res_body is None:
+			# small hot files are served from memory, mid-size hot ones from a shared mapping and the
+			# rest is streamed by the send path with sendfile
+			open_file = lambda: state.resolver.open(resolved)
+			res_body = state.file_cache.body(filename, entry, open_file)
+			if res_body is None:
+				mapped = state.mmap_pool.acquire(filename, st, open_file)
+				if mapped is not None:
+					res_body = MappedBody(state.mmap_pool, mapped, 0, st.st_size)
+					state.mmap_pool.release(mapped)
+				else:
+					res_body = FileBody(open_file(), 0, st.st_size)
+		elif not send_body:
+			if isinstance(res_body, FileBody):
+				res_body.close()
+			res_body = None
+
+		res = Response(200, res_body, entry.content_type, res_body_len, extra_headers)
+		self.access_log(req, res)
+		return res
+
+	# 404 or 401 for a static file that is missing or unreadable, with the error page as body
+	# (HEAD only gets its length)
+	def static_error_response(self, req, status_code, send_body = True):
+		res_body = self.error_pages[status_code]
+		self.error_log(req, status_code)
+		res = Response(status_code, res_body if send_body else None, 'text/html', len(res_body))
+		self.access_log(req, res)
+		return res
 
-			else:
-				response_line = self.response_line(401)
-				res_body = "<h1>401 Unauthorized</h1>"
-				res_body = res_body.encode('ascii')
-				self.file_type = 'text/html'
-				self.error_log(req, response_line)
-				self.res_body_len = len(res_body)
-				response_headers = self.response_headers(req)
-				self.access_log(req, response_line, self.res_body_len)
-				return f'{response_line}{response_headers}{blank_line}', res_body
-		
-		else:
-			response_line = self.response_line(404)
-			res_body = "<h1>404 Not Found</h1>"
-			res_body = res_body.encode('ascii')
-			self.file_type = 'text/html'
-			self.error_log(req, response_line)
-			self.res_body_len = len(res_body)
-			response_headers = self.response_headers(req)
-			self.access_log(req, response_line, self.res_body_len)
-			return f'{response_line}{response_headers}{blank_line}', res_body
-
-		# getting content length of HTTP response body
-		self.res_body_len = len(res_body)
-		lmtime = self.get_last_modified_time(filename)
-		response_headers = self.response_headers(req, {'Last-Modified': lmtime})
-
-		# checking if-modified-since 
-		if 'If-Modified-Since' in req.req_headers.keys():
-			x, val = self.if_modified_since_handler(req.req_headers['If-Modified-Since'], lmtime)
-			if not x:
-				response_line = self.response_line(304)
-				self.res_body_len = 0
-				response_headers = self.response_headers(req)
-				self.access_log(req, response_line, self.res_body_len)
-				return f'{response_line}{response_headers}{blank_line}', None
-
-		# checking if-modified-since 
-		if 'If-Unmodified-Since' in req.req_headers.keys():
-			x, val = self.if_unmodified_since_handler(req.req_headers['If-Unmodified-Since'], lmtime)
-			if not x:
-				response_line = self.response_line(412)
-				self.res_body_len = 0
-				response_headers = self.response_headers(req)
-				self.access_log(req, response_line, self.res_body_len)
-				return f'{response_line}{response_headers}{blank_line}', None
-
-		self.access_log(req, response_line, self.res_body_len)
-		return f'{response_line}{response_headers}{blank_line}', res_body
-
-
-	# File uploading yet to be handled
+	def handle_GET(self, req):
+		return self.serve_static(req)
+
+	# GET and HEAD of a file under the document root; paths leaving it are forbidden
+	def serve_static(self, req, send_body = True):
+		resolver = req.state.resolver
+		resolved = resolver.resolve(req.path)
+		if resolved is None:
+			return self.static_error_response(req, 403, send_body)
+
+		st = resolver.stat(resolved)
+		if st is None:
+			return self.static_error_response(req, 404, send_body)
+
+		if S_ISDIR(st.st_mode):
+			return self.directory_response(req, resolved, st, send_body)
+
+		if not resolver.access(resolved, os.R_OK):
+			return self.static_error_response(req, 401, send_body)
+
+		return self.static_file_response(req, resolved, st, send_body)
+
+	# a directory is answered with its first DirectoryIndex file, or with a generated listing
+	# (paged by ?page=n) when AutoIndex is on
+	def directory_response(self, req, resolved, st, send_body = True):
+		if not req.path.endswith('/'):
+			# relative links of the index only resolve against the directory with a trailing slash
+			location = quote(req.path + '/') + ('?' + req.raw_query if req.raw_query else '')
+			res = Response(301, headers = {'Location': location})
+			self.access_log(req, res)
+			return res
+
+		state = req.state
+		resolver = state.resolver
+		for name in state.directory_index:
+			index = resolver.resolve(req.path + name)
+			index_st = resolver.stat(index) if index is not None else None
+			if index_st is not None and not S_ISDIR(index_st.st_mode):
+				if not resolver.access(index, os.R_OK):
+					return self.static_error_response(req, 401, send_body)
+				return self.static_file_response(req, index, index_st, send_body)
+
+		if not state.auto_index:
+			return self.static_error_response(req, 404, send_body)
+		if not resolver.access(resolved, os.R_OK | os.X_OK):
+			return self.static_error_response(req, 401, send_body)
+
+		# the scan of a large directory is cached until its entries change; pages are sliced from it
+		listing = state.listing_cache.lookup(resolved.filename, st)
+		try:
+			page = int(req.query.get('page', ['1'])[-1])
+		except ValueError:
+			page = 0
+		res_body = render_page(listing, req.path, page, state.auto_index_page_size)
+		if res_body is None:
+			return self.static_error_response(req, 404, send_body)
+
+		res = Response(200, res_body if send_body else None, 'text/html; charset=utf-8', sum(len(chunk) for chunk in res_body),
+			{'Last-Modified': self.get_last_modified_time(st)})
+		self.access_log(req, res)
+		return res
+
+
+	# form submissions are logged under post_data/; files uploaded with multipart/form-data are
+	# streamed to disk as they arrive
 	def handle_POST(self, req):
-		filename = req.uri.strip('/')
-		response_line = self.response_line(200)
+		state = req.state
+		status_code = 200
 		curr_datetime = datetime.datetime.now()
-		res_body = "<h1>Form has been submitted</h1>"
-		data = req.req_body
+		res_body = b"<h1>Form has been submitted</h1>"
+		content_type = req.req_headers.get('Content-Type', '')
 		
 		
-		if req.req_headers['Content-Type'] == 'application/x-www-form-urlencoded':
-			file_dir = os.path.join(self.documentRoot, "post_data", "post_data_urlencoded.txt")
+		if content_type == 'application/x-www-form-urlencoded':
+			data = req.body_text()
+			file_dir = os.path.join(state.document_root, "post_data", "post_data_urlencoded.txt")
 			f = open(file_dir, 'a')
 			if data:
 				res = dict(i.split('=') for i in data.split('&'))
@@ -272,314 +689,216 @@ class HTTPServer(TCPServer):
 			f.write('\n')
 
 
-		elif req.req_headers['Content-Type'].split(';')[0] == 'multipart/form-data':
-			file_dir = os.path.join(self.documentRoot, "post_data", "post_data_multipart.txt")
-			f = open(file_dir, 'a')
+		elif content_type.split(';')[0] == 'multipart/form-data':
+			file_dir = os.path.join(state.document_root, "post_data", "post_data_multipart.txt")
 			res = []
-			if data:
-				# getting the boundary value from headers
-				boundary = req.req_headers['Content-Type'].split(';')[1]
-				boundary_val = '--' + boundary.split('=')[1]
-				# splitting on boundary value
-				data = data.lstrip(boundary_val).split(boundary_val)[:-1]
-				for i in data:
-					i = i.strip('\r\n')
-					l = i.split('\r\n\r\n', 1)
-					head = l[0].split('\r\n')
-					headers = head[0].split('; ')
-					contype = []
-					if len(head) > 1:
-						# if file has been uploaded
-						data = None
-						contype.append(head[1])
-						# getting file name that is uploaded
-						filename = headers[2].split('=')[1].strip('"')
-						filename = os.path.join(self.documentRoot, filename) if filename != '' else filename
-						if len(l) > 1:
-							data = l[1]
-							data = data.encode('iso-8859-1')
-							# creating the uploaded file on the server 
-							if not os.path.exists(filename):
-								response_line = self.response_line(201)
-								if filename:
-									f2 = open(filename, 'wb')
-									if data:
-										f2.write(data)
-							content = [data.decode('iso-8859-1')]
-
-						result = headers + contype + content
-						res.append(result)
-					else:
-						if len(l) > 1:
-							content = [l[1]]
-						result = headers + contype + content
-						res.append(result)
-				
-				f.write(str(curr_datetime) + ' : ' + str(res))
-			else:
-				f.write(str(curr_datetime) + ' : ' + 'No data')
-			f.write('\n')
-
-		# getting content length of HTTP response body
-		self.res_body_len = self.clen(res_body)
-		
-		self.access_log(req, response_line, self.res_body_len)
-		self.file_type = 'text/html'
-		response_headers = self.response_headers(req)
-		blank_line = '\r\n'
-
-		return f'{response_line}{response_headers}{blank_line}', res_body.encode('ascii')
+			if req.req_body:
+				boundary = header_params(content_type).get('boundary')
+				if not boundary:
+					return self.http_400_handler(req)
+				for part in MultipartReader(req.req_body, boundary, state.multipart_max_parts, state.multipart_max_header_size):
+					if part.filename is None:
+						part.read(state.multipart_max_field_size)
+					elif part.filename and self.save_upload(state, part):
+						status_code = 201
+					# only the metadata of a part is logged, never its contents
+					res.append({'name': part.name, 'filename': part.filename, 'content_type': part.content_type, 'size': part.size})
+
+			with open(file_dir, 'a') as f:
+				f.write(str(curr_datetime) + ' : ' + (str(res) if res else 'No data') + '\n')
+
+		res = Response(status_code, res_body, 'text/html')
+		self.access_log(req, res)
+
+		return res
+
+	# writes an uploaded file part into the document root chunk by chunk, unless a file of that
+	# name already exists there; True when the file was created
+	def save_upload(self, state, part):
+		# only the last path component of the client's filename is used
+		resolved = state.resolver.resolve('/' + os.path.basename(part.filename.replace('\\', '/')))
+		if resolved is None or resolved.target in (None, state.resolver.root):
+			return False
+		filename = resolved.target # an existing symlink of that name is not written through
+		try:
+			f = open(filename, 'xb')
+		except (FileExistsError, IsADirectoryError):
+			return False
+		try:
+			with f:
+				for chunk in part:
+					f.write(chunk)
+		except BaseException:
+			os.remove(filename) # no half-written uploads
+			raise
+		self.invalidate(state, filename)
+		return True
+
+	# drops what the caches of state hold about a file (or everything under a directory) that we
+	# changed ourselves
+	def invalidate(self, state, filename):
+		state.file_cache.invalidate(filename)
+		state.mmap_pool.invalidate(filename)
+		state.resolver.invalidate(filename)
+
+	# reads httpserver.config and checks every line against the directive schema
+	# (HTTP_config.SCHEMA): the compiled Config snapshot and the problems found
 	def handle_config(self):
-		with open(CONFIG, 'r') as f:
-			conf = f.readlines()
-
-		config = {}
-
-		if len(conf):
-			conf = [conf[i].strip('\r\n ') for i in range(len(conf)) if conf[i][0] != '\n' and conf[i][0] != '#']
-			for item in conf:
-				if item.find('#') != -1:
-					item = item[ : item.find('#')]
-				items = item.split(' ')
-				if len(items) > 1:
-					config_name = items[0]
-					config_val = items[1]
-					if config_name == 'CookieName':
-						if items[-1][-1] != ';' and len(items) > 2:
-							print('Invalid Config: Cookie definition syntax error')
-							break
-						cookie_pref = ' '.join(items[2 : ])
-						config_val += f';{cookie_pref}' 
-						if config.get(config_name):
-							config[config_name].append(config_val)
-						else:
-							config[config_name] = [config_val]
-					elif config_name == 'DocumentRoot':
-						if config.get(config_name):
-							print("Multiple DocumentRoot values found, config value set to the first value configuration")
-						else:
-							if len(items) > 2:
-								print("Invalid config: DocumentRoot definition syntax error")
-								break
-							config[config_name] = str(config_val)
-					elif config_name == "Server":
-						if config.get(config_name):
-							print("Multiple Server name values found, config value set to the first value configuration")
-						else:
-							if len(items) > 2:
-								print("Invalid config: ServerName definition syntax error")
-								break
-							self.headers['Server'] = str(config_val)
-							config[config_name] = str(config_val)
-					elif config_name == "MaxActiveConn":
-						if config.get(config_name):
-							print("Multiple Max Active connections values found, config value set to the first value configuration")
-						else:
-							if len(items) > 2:
-								print("Invalid config: Max Active Connections definition syntax error")
-								break
-							config[config_name] = int(config_val)
-					elif config_name == "AccessLog":
-						if config.get(config_name):
-							print("Multiple Access log specifications found, config value set to the first value configuration")
-						else:
-							if len(items) > 2:
-								print("Invalid config: Access Log")
-								break
-							config[config_name] = str(config_val)
-					elif config_name == "ErrorLog":
-						if config.get(config_name):
-							print("Multiple Error log specifications found, config value set to the first value configuration")
-						else:
-							if len(items) > 2:
-								print("Invalid config: Error Log")
-								break
-							config[config_name] = str(config_val)
-					else:
-						print(f"Configuration {config_name} not implemented!")
-			#print(config)
-		
-		return config
+		return load_config(CONFIG)
+
+	# the Content-Type, precondition and permission checks run before the body is read, so a
+	# client sending Expect: 100-continue is turned away before it transfers anything
 	def handle_PUT(self, req):
-		filename = req.uri.strip('/')
-		data = req.req_body
-		data = data.encode('iso-8859-1')
+		filename = req.path.strip('/')
 		resource_type = req.req_headers.get('Content-Type') if req.req_headers.get('Content-Type') else 'text/plain'
 		resource_extension = mimetypes.guess_extension(resource_type)
 		uri_extension = '.' + filename.split('.')[-1]
+		state = req.state
+		resolved = state.resolver.resolve(req.path)
 
 		if uri_extension != resource_extension:
-			response_line = self.response_line(415)
-			self.error_log(req, response_line)
+			status_code = 415
+			self.error_log(req, status_code)
+		elif resolved is None or resolved.target in (None, state.resolver.root):
+			status_code = 403
+			self.error_log(req, status_code)
 		else:
 			# creating/ modifying the file on the server
-			filename = os.path.join(self.documentRoot, filename) if filename != '' else filename
-			if os.path.exists(filename):
-				# checking write permissions for modifying file
-				if os.access(filename, os.W_OK):
-					response_line = self.response_line(200)
-					f = open(filename, 'w+b')
-					if data:
-						f.write(data)
-				else:
-					response_line = self.response_line(401)
-					self.error_log(req, response_line)
+			filename = resolved.filename
+			st = self.stat_file(filename)
+			precondition = self.check_write_preconditions(req, resolved, st)
+			if precondition:
+				status_code = precondition
+				self.error_log(req, status_code)
+			# checking write permissions for modifying file
+			elif st is not None and not os.access(filename, os.W_OK):
+				status_code = 401
+				self.error_log(req, status_code)
 			else:
-				# creating file on server
-				response_line = self.response_line(201)
-				f = open(filename, 'wb')
-				if data:
-					f.write(data)
-
-		self.res_body_len = 0
-		self.access_log(req, response_line, self.res_body_len)
-		response_headers = self.response_headers(req, {'Content-Location': filename})
-		blank_line = '\r\n'
+				# a symlink at the request path is replaced itself, not the file it points to
+				self.replace_file(state, resolved.target, req.req_body, st)
+				status_code = 200 if st is not None else 201
+				self.invalidate(state, filename)
+				if resolved.target != filename:
+					self.invalidate(state, resolved.target)
+
+		# the decoded path is re-encoded: header values must stay within latin-1 and free of CR/LF
+		res = Response(status_code, headers = {'Content-Location': quote(req.path)})
+		self.access_log(req, res)
+
+		return res
+
+	# streams body into a temporary file next to filename and renames it over filename, so
+	# readers see either the previous file or the complete new one, never a partial write.
+	# st is the stat result of the file being replaced, None for a new file
+	def replace_file(self, state, filename, body, st):
+		directory = os.path.dirname(filename) or '.'
+		fd, temp = tempfile.mkstemp(dir = directory, prefix = '.' + os.path.basename(filename) + '.', suffix = '.tmp')
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				if body:
+					shutil.copyfileobj(body, f, RECV_SIZE)
+				if state.put_fsync != 'off':
+					f.flush()
+					os.fsync(f.fileno())
+			# mkstemp creates the file private to us
+			os.chmod(temp, st.st_mode & 0o7777 if st is not None else 0o666 & ~UMASK)
+			os.replace(temp, filename)
+		except BaseException:
+			try:
+				os.remove(temp)
+			except OSError:
+				pass
+			raise
 
-		return f'{response_line}{response_headers}{blank_line}', None
+		if state.put_fsync == 'full':
+			dir_fd = os.open(directory, os.O_RDONLY)
+			try:
+				os.fsync(dir_fd)
+			finally:
+				os.close(dir_fd)
 
 	def handle_HEAD(self, req):
 		# contains meta info about the reponse
 		# identical to GET except doesnt return the response body 
-		filename = req.uri.strip('/')
-		filename = os.path.join(self.documentRoot, filename) if filename != '' else filename
-		blank_line = '\r\n'
-
-		if os.path.exists(filename):
-			if os.access(filename, os.R_OK):
-				response_line = self.response_line(200)
-				with open(filename, 'rb') as f:
-					res_body = f.read()
-
-				# In HEAD, content type is of the file that would have been sent had the request been a GET
-				self.file_type = self.ctype(filename)
-			else:
-				response_line = self.response_line(401)
-				res_body = "<h1>401 Unauthorized</h1>"
-				res_body = res_body.encode('ascii')
-				self.file_type = 'text/html'
-				self.error_log(req, response_line)
-				self.res_body_len = len(res_body)
-				self.access_log(req, response_line, self.res_body_len)
-				response_headers = self.response_headers(req)
-				return f'{response_line}{response_headers}{blank_line}', None
-
-		else:
-			response_line = self.response_line(404)
-			res_body = "<h1>404 Not Found</h1>"
-			res_body = res_body.encode('ascii')
-			self.file_type = 'text/html'
-			self.error_log(req, response_line)
-			self.res_body_len = len(res_body)
-			self.access_log(req, response_line, self.res_body_len)
-			response_headers = self.response_headers(req)
-			return f'{response_line}{response_headers}{blank_line}', None
-
-		# In HEAD, content length is the size of the entity-body that would have been sent had the request been a GET.
-		self.res_body_len = len(res_body)
-		lmtime = self.get_last_modified_time(filename)
-		response_headers = self.response_headers(req, {'Last-Modified': lmtime})
-
-		# checking if-modified-since 
-		if 'If-Modified-Since' in req.req_headers.keys():
-			x, val = self.if_modified_since_handler(req.req_headers['If-Modified-Since'], lmtime)
-			if not x:
-				response_line = self.response_line(304)
-				self.res_body_len = 0
-				response_headers = self.response_headers(req)
-		
-		# checking if-unmodified-since 
-		if 'If-Unmodified-Since' in req.req_headers.keys():
-			x, val = self.if_unmodified_since_handler(req.req_headers['If-Unmodified-Since'], lmtime)
-			if not x:
-				response_line = self.response_line(412)
-				self.res_body_len = 0
-				response_headers = self.response_headers(req)
-				self.access_log(req, response_line, self.res_body_len)
-				return f'{response_line}{response_headers}{blank_line}', None
-
-		self.access_log(req, response_line, self.res_body_len)
-		return f'{response_line}{response_headers}{blank_line}', None
+		# answered from the stat result; the file is only read to size an uncached gzip variant
+		return self.serve_static(req, send_body = False)
 
 	def handle_DELETE(self, req):
-		filename = req.uri.strip('/')
-		filename = os.path.join(self.documentRoot, filename) if filename != '' else filename
-		if os.path.exists(filename):
-			if os.path.isfile(filename):
-				os.remove(filename)
-			elif os.path.isdir:
-				shutil.rmtree(filename)
+		state = req.state
+		resolved = state.resolver.resolve(req.path)
+		# nothing outside the document root, nor the root itself, can be deleted
+		if resolved is None or resolved.target in (None, state.resolver.root):
+			return self.static_error_response(req, 403)
+		filename = resolved.filename
+		target = resolved.target
+		st = self.stat_file(filename)
+		precondition = self.check_write_preconditions(req, resolved, st)
+		if precondition:
+			return self.static_error_response(req, precondition)
+		if st is not None:
+			# the request path itself is removed: a symlink goes, not what it points to
+			if not S_ISDIR(os.lstat(target).st_mode):
+				os.remove(target)
+			else:
+				shutil.rmtree(target)
+			self.invalidate(state, filename)
+			if target != filename:
+				self.invalidate(state, target)
 				
-			response_line = self.response_line(200)
-			res_body = f"<h1>File Deleted.</h1>"
+			status_code = 200
+			res_body = b"<h1>File Deleted.</h1>"
 			
 		else:
-			response_line = self.response_line(404)
-			res_body = "<h1>404 Not Found</h1>"
-			self.error_log(req, response_line)
-		
-		# getting content length of HTTP response body
-		self.res_body_len = self.clen(res_body)
+			status_code = 404
+			res_body = self.error_pages[404]
+			self.error_log(req, status_code)
 		
-		self.file_type = 'text/html'
-		self.access_log(req, response_line, self.res_body_len)
-		response_headers = self.response_headers(req)
-		blank_line = '\r\n'
+		res = Response(status_code, res_body, 'text/html')
+		self.access_log(req, res)
 
-		return f'{response_line}{response_headers}{blank_line}', res_body.encode('ascii')
+		return res
 
-	def response_line(self, status_code):
-		status = self.status_codes[status_code][0]
-		return f'HTTP/1.1 {status_code} {status}\r\n'
-	
-	def response_headers(self, req, extra_headers = {}):
-		# the date and time at which message was originated (location of this line of code is uncertain)
-		self.headers['Date'] = formatdate(timeval=None, localtime=False, usegmt=True) 
-
-		self.headers['Content-Length'] = self.res_body_len
-		#print(self.res_body_len)#519530
-		self.headers['Content-Type'] = self.file_type
-
-		res_headers = self.headers.copy()
-
-		if extra_headers:
-			res_headers.update(extra_headers)
-		
-		headers = ""
+	# status line, header fields and blank line of a response, assembled as bytes from
+	# preencoded fragments
+	def response_head(self, req, res):
+		state = req.state
+		parts = [self.status_lines[res.status_code]]
 
 		if req.req_headers.get('Cookie') == None:
-			headers += self.handle_cookies()
-
-		for header in res_headers:
-			headers += f'{header}: {res_headers[header]}\r\n'
-
-		return headers	
+			cookies = self.handle_cookies(state)
+			if cookies:
+				parts.append(cookies.encode('latin-1'))
+
+		parts.append(self.header_date.now())
+		parts.append(state.static_headers)
+		# a 304 has no body, and a Content-Length of 0 would misstate the selected representation
+		if res.status_code != 304:
+			parts.append(b'Content-Length: %d\r\n' % res.content_length)
+		if res.content_type:
+			parts.append(f'Content-Type: {res.content_type}\r\n'.encode('latin-1'))
+		for header, value in res.headers.items():
+			parts.append(f'{header}: {value}\r\n'.encode('latin-1'))
+		parts.append(state.connection_headers[req.keep_alive])
+		parts.append(b'\r\n')
+
+		return b''.join(parts)
 
 	# logging all requests in access logs
-	def access_log(self, req, response_line, size):
-		timezone = tzlocal.get_localzone()
-		curr_datetime = datetime.datetime.now(timezone).strftime("%d/%b/%Y:%H:%M:%S %z")
-		status_code = response_line.split(' ')[1]
-		f = open(self.log_file_locations['accesslog'], 'a+')
-		f.write(f"{req.client_ip} - - [{curr_datetime}] \"{req.req_line}\" {status_code} {size}\n")
-		f.close()
+	def access_log(self, req, res):
+		self.log_writer.write(req.state.access_log,
+			f"{req.client_ip} - - [{self.log_time.now()}] \"{req.req_line}\" {res.status_code} {res.content_length}\n")
 
 	# logging errors in error logs
-	def error_log(self, req, response_line):
-		timezone = tzlocal.get_localzone()
-		curr_datetime = datetime.datetime.now(timezone).strftime("%d/%b/%Y:%H:%M:%S %z")
-		status_code = response_line.split(' ')[1]
-		error_msg = response_line.split(' ')[2].rstrip('\r\n')
-		f = open(self.log_file_locations['errorlog'], 'a+')
+	def error_log(self, req, status_code):
+		error_msg = self.status_codes[status_code][0]
 		# defined two levels of logging - client and server
-		if int(status_code) >= 400 and int(status_code) < 500:
+		if status_code >= 400 and status_code < 500:
 			level = 'client'
-			f.write(f"[{curr_datetime}] \"{req.req_line}\" [{level} error] [client {req.client_ip}] {status_code} {error_msg}\n")
 		else:
 			level = 'server'
-			f.write(f"[{curr_datetime}] \"{req.req_line}\" [{level} error] [client {req.client_ip}] {status_code} {error_msg}\n")
-
-		f.close()
+		self.log_writer.write(req.state.error_log,
+			f"[{self.log_time.now()}] \"{req.req_line}\" [{level} error] [client {req.client_ip}] {status_code} {error_msg}\n")
 
 if __name__ == '__main__':
 	server = HTTPServer()
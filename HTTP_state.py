@@ -0,0 +1,96 @@
+from HTTP_cache import FileCache
+from HTTP_mmap import MmapPool
+from HTTP_autoindex import ListingCache
+from HTTP_resolve import PathResolver
+from HTTP_profile import ProfileSettings
+
+#everything the server derives from one Config snapshot: the snapshot itself, the settings the
+#transports and handlers read, the path resolver and caches and the preencoded header fragments.
+#It is built in full, published with a single assignment to the server's state and never modified
+#after, so a request that read the reference once works against one consistent configuration to
+#its end without taking a lock. Caches whose own settings didn't change are carried over from the
+#previous state
+class RuntimeState:
+	__slots__ = ('config', 'document_root', 'resolver', 'file_cache', 'mmap_pool', 'listing_cache',
+		'server_mode', 'worker_processes', 'max_active_connections', 'listen_backlog', 'queue_depth',
+		'retry_after', 'keep_alive_timeout', 'max_keep_alive_requests', 'max_header_size', 'max_body_size',
+		'graceful_timeout', 'socket_send_buffer', 'socket_recv_buffer', 'etag_content_hash', 'put_fsync',
+		'metrics_path', 'multipart_max_parts', 'multipart_max_field_size', 'multipart_max_header_size',
+		'directory_index', 'auto_index', 'auto_index_page_size', 'cookies', 'access_log', 'error_log',
+		'profile_mode', 'profile', 'log_limits', 'static_headers', 'connection_headers')
+
+	def __init__(self, config, previous = None):
+		def changed(*names):
+			return previous is None or any(config[name] != previous.config[name] for name in names)
+
+		self.config = config
+		# the schema already checked that the directory exists
+		self.document_root = config['DocumentRoot'].strip('/')
+		if changed('DocumentRoot', 'PathCacheMaxEntries'):
+			self.resolver = PathResolver(self.document_root, config['PathCacheMaxEntries'])
+		else:
+			self.resolver = previous.resolver
+		if changed('CacheMaxBytes', 'CacheMaxEntries', 'CacheMaxFileSize', 'ETagContentHash'):
+			self.file_cache = FileCache(config['CacheMaxBytes'], config['CacheMaxEntries'], config['CacheMaxFileSize'])
+		else:
+			self.file_cache = previous.file_cache
+		if changed('MmapMaxBytes', 'MmapMaxEntries', 'MmapMaxFileSize', 'MmapMinHits'):
+			self.mmap_pool = MmapPool(config['MmapMaxBytes'], config['MmapMaxEntries'], config['MmapMaxFileSize'], config['MmapMinHits'])
+		else:
+			self.mmap_pool = previous.mmap_pool
+		self.listing_cache = ListingCache(config['AutoIndexCacheEntries']) if changed('AutoIndexCacheEntries') else previous.listing_cache
+
+		self.server_mode = config['ServerMode']
+		self.worker_processes = config['WorkerProcesses']
+		self.max_active_connections = config['MaxActiveConn'] # size of the worker pool
+		self.listen_backlog = config['ListenBacklog']
+		self.queue_depth = config['QueueDepth'] # accepted connections allowed to wait for a free worker
+		self.retry_after = config['RetryAfter'] # seconds a rejected client is told to wait
+		self.keep_alive_timeout = config['KeepAliveTimeout'] # seconds an idle persistent connection is kept open
+		self.max_keep_alive_requests = config['MaxKeepAliveRequests'] # requests served on one connection
+		self.max_header_size = config['MaxHeaderSize']
+		self.max_body_size = config['MaxBodySize']
+		self.graceful_timeout = config['GracefulTimeout'] # seconds in-flight connections get on shutdown
+		self.socket_send_buffer = config['SocketSendBuffer'] # 0 for the kernel's default
+		self.socket_recv_buffer = config['SocketRecvBuffer']
+
+		self.etag_content_hash = config['ETagContentHash']
+		self.put_fsync = config['PutFsync']
+		metrics_path = config['MetricsPath']
+		self.metrics_path = None if metrics_path == 'off' else '/' + metrics_path.strip('/')
+		self.multipart_max_parts = config['MultipartMaxParts']
+		self.multipart_max_field_size = config['MultipartMaxFieldSize']
+		self.multipart_max_header_size = config['MultipartMaxHeaderSize']
+		self.directory_index = config['DirectoryIndex']
+		self.auto_index = config['AutoIndex']
+		self.auto_index_page_size = config['AutoIndexPageSize']
+		self.cookies = config['CookieName']
+		self.access_log = config['AccessLog']
+		self.error_log = config['ErrorLog']
+
+		# profiling switched on with SIGUSR1 runs in the configured mode, sampling when it is off
+		self.profile_mode = config['Profile']
+		self.profile = ProfileSettings(self.profile_mode if self.profile_mode != 'off' else 'sample', config['ProfileOutput'],
+			config['ProfileSlowRequests'], config['ProfileSampleInterval'] / 1000)
+		self.log_limits = (config['LogBatchSize'], config['LogFlushInterval'] / 1000)
+
+		# header fields that are the same on every response, preencoded
+		self.static_headers = f"Server: {config['Server']}\r\n".encode('ascii')
+		self.connection_headers = {
+			True: f'Connection: keep-alive\r\nKeep-Alive: timeout={self.keep_alive_timeout}\r\n'.encode('ascii'),
+			False: b'Connection: close\r\n'
+		}
+
+	# every attribute is set once, while the state is built
+	def __setattr__(self, name, value):
+		if hasattr(self, name):
+			raise AttributeError(f'RuntimeState is immutable, {name} is already set')
+		super().__setattr__(name, value)
+
+	# releases what the objects this state no longer shares with previous hold, once the requests
+	# still using them are done
+	def release(self, previous):
+		if previous.resolver is not self.resolver:
+			previous.resolver.close()
+		if previous.mmap_pool is not self.mmap_pool:
+			previous.mmap_pool.close()
@@ -0,0 +1,140 @@
+import os
+import select
+import signal
+import sys
+import time
+import traceback
+
+#pre-fork supervisor: runs the server's accept loop in N worker processes, each binding its own
+#SO_REUSEPORT listening socket on the same port, and restarts workers that die.
+#SIGTERM/SIGINT stop the workers gracefully, SIGHUP re-reads the config and replaces them.
+#The signal handlers only record what was asked; forking, reloading and reaping happen in the
+#main loop, which the handlers wake through signal.set_wakeup_fd, so a signal arriving during a
+#reload can't re-enter it
+class PreforkSupervisor:
+	def __init__(self, server):
+		self.server = server
+		self.workers = {} # pid -> (generation, start time)
+		self.generation = 0
+		self.stopping = False
+		self.stop_requested = False
+		self.reload_requested = False
+		self.forward_requested = [] # signals to pass on to the workers
+		self.wakeup = None # (read end, write end) of the wakeup pipe
+
+	def spawn(self):
+		pid = os.fork()
+		if pid == 0:
+			code = 0
+			try:
+				signal.set_wakeup_fd(-1)
+				for fd in self.wakeup:
+					os.close(fd)
+				signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+				signal.signal(signal.SIGHUP, signal.SIG_IGN)
+				signal.signal(signal.SIGTERM, signal.SIG_DFL)
+				signal.signal(signal.SIGINT, signal.SIG_IGN) # the supervisor forwards shutdown as SIGTERM
+				self.server.serve()
+			except BaseException:
+				traceback.print_exc()
+				code = 1
+			finally:
+				sys.stdout.flush()
+				os._exit(code)
+		self.workers[pid] = (self.generation, time.monotonic())
+
+	def signal_workers(self, sig, generation = None):
+		for pid, (gen, started) in list(self.workers.items()):
+			if generation is None or gen == generation:
+				try:
+					os.kill(pid, sig)
+				except ProcessLookupError:
+					pass
+
+	# signal handlers: only flags, acted on by the main loop
+	def request_stop(self, signum, frame):
+		self.stop_requested = True
+
+	def request_reload(self, signum, frame):
+		self.reload_requested = True
+
+	# SIGUSR1 toggles request profiling in every worker
+	def forward(self, signum, frame):
+		self.forward_requested.append(signum)
+
+	def stop(self):
+		if not self.stopping:
+			print('Shutting down workers...')
+			self.stopping = True
+			self.signal_workers(signal.SIGTERM)
+
+	# graceful reload: new workers are started with the re-read config before the old
+	# generation is asked to finish its in-flight requests and exit. A config that doesn't
+	# validate leaves the running workers alone
+	def reload(self):
+		if self.stopping:
+			return
+		if not self.server.apply_config(reload = True):
+			return
+		print('Reloading workers...')
+		old_generation = self.generation
+		self.generation += 1
+		for i in range(self.server.state.worker_processes):
+			self.spawn()
+		self.signal_workers(signal.SIGTERM, old_generation)
+
+	# workers that exited since the last call; a worker of the current generation that died on
+	# its own is replaced
+	def reap(self):
+		while self.workers:
+			try:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+			except ChildProcessError:
+				self.workers.clear()
+				return
+			if pid == 0:
+				return
+			generation, started = self.workers.pop(pid, (None, 0))
+			if self.stopping or generation != self.generation:
+				continue
+
+			print(f'Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting')
+			if time.monotonic() - started < 1:
+				time.sleep(1) # don't spin on a worker that crashes at startup
+			self.spawn()
+
+	# sleeps until a signal arrives (SIGCHLD included) or timeout seconds passed
+	def wait(self, timeout):
+		try:
+			select.select([self.wakeup[0]], [], [], timeout)
+			while os.read(self.wakeup[0], 512):
+				pass
+		except (BlockingIOError, InterruptedError):
+			pass
+
+	def start(self):
+		self.wakeup = os.pipe()
+		for fd in self.wakeup:
+			os.set_blocking(fd, False)
+		signal.set_wakeup_fd(self.wakeup[1])
+		signal.signal(signal.SIGCHLD, lambda signum, frame: None) # only wakes the loop
+		signal.signal(signal.SIGTERM, self.request_stop)
+		signal.signal(signal.SIGINT, self.request_stop)
+		signal.signal(signal.SIGHUP, self.request_reload)
+		signal.signal(signal.SIGUSR1, self.forward)
+
+		for i in range(self.server.state.worker_processes):
+			self.spawn()
+		print(f'Started {self.server.state.worker_processes} worker processes')
+
+		while self.workers:
+			if self.stop_requested:
+				self.stop()
+			if self.reload_requested:
+				self.reload_requested = False
+				self.reload()
+			while self.forward_requested:
+				self.signal_workers(self.forward_requested.pop(0), self.generation)
+			self.reap()
+			if self.workers:
+				self.wait(1)
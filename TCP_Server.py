@@ -1,7 +1,19 @@
 import socket
+import selectors
 import sys
 import threading
+import queue
 import time
+import signal
+from HTTP_reader import RequestReader, RequestError
+from Async_Server import AsyncServer, REJECT_DRAIN_TIMEOUT
+from Prefork_Server import PreforkSupervisor
+from HTTP_response import send_response
+from HTTP_metrics import Metrics, PHASE_SEND
+from HTTP_profile import Profiler
+
+# rejected connections drained at once before new ones are closed straight away
+REJECT_DRAIN_MAX = 1024
 
 class TCPServer:
 	def __init__(self, host = '127.0.0.1', port = 12000):
@@ -9,27 +21,150 @@ class TCPServer:
 		self.port = port
 		self.tcp_socket = None
 		self.active_conn = 0
-		self.max_active_connections = 0
+		self.admitted_conn = 0 # handed to the worker pool and not closed yet, queued or active
+		self.conn_lock = threading.Lock()
+		self.conn_queue = None
+		self.reject_queue = None
+		# settings in effect (HTTP_state.RuntimeState), published by apply_config and read once
+		# per connection
+		self.state = None
+		self.stopping = False
+		self.metrics = Metrics()
+		self.profiler = Profiler()
+		self.metrics.describe('http_phase_seconds', 'histogram', 'Time spent parsing requests, in handlers and sending responses.')
+		self.metrics.describe('http_connections_accepted_total', 'counter', 'Connections accepted.')
+		self.metrics.describe('http_connections_rejected_total', 'counter', 'Connections answered with 503 because the server was full.')
+		self.metrics.gauge('http_connections_active', 'Connections being served.', lambda: self.active_conn)
+		self.metrics.gauge('http_connections_queued', 'Accepted connections waiting for a worker.', self.queued_connections)
 
 	def handle_client(self, client_socket, addr):
-		if self.active_conn > self.max_active_connections:
-			print('Max limit exceeded! Waiting for 5 sec...')
-			time.sleep(5)
-			self.active_conn = 0
-			return
-		else:
+		with self.conn_lock:
 			self.active_conn += 1
-			data = client_socket.recv(65536)
-			if data:
-				response, message = self.handle_request(data, addr)
-				client_socket.send(response.encode('ascii'))
-				if message:
-					client_socket.send(message)
-			client_socket.shutdown(socket.SHUT_RDWR)
-			self.active_conn -= 1
+		state = self.state
+		client_socket.settimeout(state.keep_alive_timeout)
+		reader = RequestReader(client_socket, state.max_header_size, state.max_body_size)
+		served = 0
+		try:
+			self.tune_socket(client_socket, state)
+			# persistent connection: keep answering requests (pipelined ones in order) until
+			# the client asks to close, goes idle or the per-connection request cap is reached
+			while served < state.max_keep_alive_requests and not self.stopping:
+				head, body = reader.read_request()
+				if not head:
+					break
+				served += 1
+				keep_alive = served < state.max_keep_alive_requests and not self.stopping
+				trace = self.profiler.begin(head) if self.profiler.enabled else None
+				if trace is None:
+					response, message, keep_alive = self.handle_request(head, addr, keep_alive, body)
+				else:
+					response, message, keep_alive = self.profiler.call(trace, self.handle_request, head, addr, keep_alive, body)
+				started = time.perf_counter()
+				send_response(client_socket, response, message)
+				sent = time.perf_counter() - started
+				self.metrics.observe('http_phase_seconds', PHASE_SEND, sent)
+				if trace is not None:
+					self.profiler.end(trace, sent)
+				# whatever the handler left of the body has to be consumed before the next request.
+				# A body found malformed now can't be answered any more, the response is out
+				try:
+					if body is not None and not body.drain():
+						break
+				except RequestError:
+					break
+				if not keep_alive:
+					break
+		except RequestError as e:
+			response, message, keep_alive = self.handle_error(e.status_code, addr)
+			send_response(client_socket, response, message)
+		except (socket.timeout, ConnectionError):
+			pass
+		finally:
+			try:
+				client_socket.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+			with self.conn_lock:
+				self.active_conn -= 1
+				self.admitted_conn -= 1
 			client_socket.close()
 
+	# worker thread: serves connections handed over by the accept loop
+	def worker(self):
+		while True:
+			conn, addr = self.conn_queue.get()
+			try:
+				self.handle_client(conn, addr)
+			except Exception as e:
+				print(f"Exception {e}")
+			print(f"Connection closed {addr}")
+
+	# answers a connection the pool has no room for with a quick 503, from the accept loop: the
+	# response is small enough for one non-blocking send to put it in the socket buffer. The
+	# socket is then left to the rejecter to be closed
+	def reject(self, conn, addr):
+		response, message, keep_alive = self.handle_error(503, addr, {'Retry-After': self.state.retry_after})
+		try:
+			conn.setblocking(False)
+			conn.send(response + message)
+			conn.shutdown(socket.SHUT_WR)
+		except OSError:
+			conn.close()
+			return
+		self.reject_queue.put(conn)
+
+	# closes rejected connections once the client finished sending its request, or after
+	# REJECT_DRAIN_TIMEOUT: closing with unread request bytes would reset the connection and
+	# could discard the 503 before the client read it. One thread drains all of them through a
+	# selector, so no rejected client waits on another or holds up the accept loop
+	def rejecter(self):
+		selector = selectors.DefaultSelector()
+		deadlines = {}
+		while True:
+			while True:
+				try:
+					conn = self.reject_queue.get(block = not deadlines)
+				except queue.Empty:
+					break
+				if len(deadlines) >= REJECT_DRAIN_MAX:
+					conn.close()
+					continue
+				selector.register(conn, selectors.EVENT_READ)
+				deadlines[conn] = time.monotonic() + REJECT_DRAIN_TIMEOUT
+
+			done = []
+			for key, events in selector.select(0.1):
+				try:
+					if key.fileobj.recv(65536):
+						continue
+				except OSError:
+					pass
+				done.append(key.fileobj)
+			now = time.monotonic()
+			done += [conn for conn, deadline in deadlines.items() if deadline < now and conn not in done]
+			for conn in done:
+				selector.unregister(conn)
+				del deadlines[conn]
+				conn.close()
+
 	def start(self):
+		if self.state.worker_processes > 1:
+			return PreforkSupervisor(self).start()
+		self.serve()
+
+	# stops accepting and lets the in-flight connections finish
+	def stop(self, signum = None, frame = None):
+		self.stopping = True
+
+	# runs the accept loop of this process
+	def serve(self):
+		state = self.state
+		if state.server_mode == 'asyncio':
+			return AsyncServer(self).start()
+
+		if threading.current_thread() is threading.main_thread():
+			signal.signal(signal.SIGTERM, self.stop)
+
 		#creating a TCP socket using IPv4 addresses 
 		self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		try:
@@ -41,26 +176,72 @@ class TCPServer:
 			#self.tcp_socket.setblocking(False)
 			self.tcp_socket.bind((self.host, self.port))
 
-			self.tcp_socket.listen(5)
+			self.tcp_socket.listen(state.listen_backlog)
 
+			# accept wakes up periodically to notice a shutdown request
+			self.tcp_socket.settimeout(1)
 			print(f'Listening at: {self.tcp_socket.getsockname()}')
 
-			while True:
+			# fixed pool of workers fed through a hand-off queue; as in asyncio mode, a connection is
+			# admitted while fewer than MaxActiveConn + QueueDepth are queued or being served, so
+			# with QueueDepth 0 only when a worker is free to take it
+			self.conn_queue = queue.Queue()
+			self.reject_queue = queue.SimpleQueue()
+			for i in range(state.max_active_connections):
+				threading.Thread(target = self.worker, daemon = True).start()
+			threading.Thread(target = self.rejecter, daemon = True).start()
+
+			while not self.stopping:
 				try:
 					conn, addr = self.tcp_socket.accept() #conn = clientSocket
 					print(f'{addr} connected!')
-					clientHandler = threading.Thread(target = self.handle_client, args = (conn, addr))
-					clientHandler.start()
-					print(f"Connection closed {addr}")
-					#clientHandler.join()
+					self.metrics.inc('http_connections_accepted_total')
+					with self.conn_lock:
+						admitted = self.admitted_conn < state.max_active_connections + state.queue_depth
+						if admitted:
+							self.admitted_conn += 1
+					if admitted:
+						self.conn_queue.put((conn, addr))
+					else:
+						print(f'Max limit exceeded! Rejecting {addr}')
+						self.metrics.inc('http_connections_rejected_total')
+						self.reject(conn, addr)
 					
+				except socket.timeout:
+					pass
 				except KeyboardInterrupt:
 				   	sys.exit()
 				except Exception as e:
 					print(f"Exception {e}")
 
 		finally:
-			pass
+			self.tcp_socket.close()
+
+		# graceful shutdown: waiting for queued and active connections to be served
+		deadline = time.monotonic() + state.graceful_timeout
+		while self.admitted_conn and time.monotonic() < deadline:
+			time.sleep(0.1)
 	
-	def handle_request(self, data, addr):
-		return data.decode('iso-8859-1')
+	# connections accepted but not picked up by a worker yet; in asyncio mode, the ones beyond
+	# the executor's threads
+	def queued_connections(self):
+		if self.conn_queue is not None:
+			return self.conn_queue.qsize()
+		return max(self.active_conn - self.state.max_active_connections, 0)
+
+	def tune_socket(self, sock, state):
+		if state.socket_send_buffer:
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, state.socket_send_buffer)
+		if state.socket_recv_buffer:
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, state.socket_recv_buffer)
+
+	# re-reads configuration before a reload, nothing to do for a bare TCP server; False when the
+	# new configuration was rejected
+	def apply_config(self, reload = False):
+		return True
+
+	def handle_request(self, data, addr, keep_alive = True, body = None):
+		return data, None, keep_alive
+
+	def handle_error(self, status_code, addr, extra_headers = {}):
+		return f'{status_code}'.encode('ascii'), None, False
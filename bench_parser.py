@@ -0,0 +1,35 @@
+import sys
+import time
+from HTTP_request import HTTPRequest
+
+# request heads the parser is timed on: a bare GET, a typical browser GET and a form POST
+SAMPLES = {
+	'minimal': b'GET /index.html HTTP/1.1\r\nHost: localhost:12000\r\n\r\n',
+	'browser': (b'GET /static/app.js?v=3&lang=en%20US HTTP/1.1\r\n'
+		b'Host: localhost:12000\r\n'
+		b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0\r\n'
+		b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+		b'Accept-Language: en-US,en;q=0.5\r\n'
+		b'Accept-Encoding: gzip, deflate, br\r\n'
+		b'Connection: keep-alive\r\n'
+		b'Cookie: SID=0123456789abcdef0123456789abcdef\r\n'
+		b'If-None-Match: "ce8014-f-18dfb931acc1a137"\r\n'
+		b'Cache-Control: max-age=0\r\n\r\n'),
+	'post': (b'POST /form.html HTTP/1.1\r\n'
+		b'Host: localhost:12000\r\n'
+		b'Content-Type: application/x-www-form-urlencoded\r\n'
+		b'Content-Length: 27\r\n\r\n'),
+}
+
+# parses each sample head repeatedly and prints how many requests per second the parser handles
+def bench(count):
+	addr = ('127.0.0.1', 50000)
+	for name, data in SAMPLES.items():
+		start = time.perf_counter()
+		for i in range(count):
+			HTTPRequest(data, addr)
+		elapsed = time.perf_counter() - start
+		print(f'{name:10} {count / elapsed:12,.0f} req/s  {elapsed / count * 1e6:7.2f} us/req')
+
+if __name__ == '__main__':
+	bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
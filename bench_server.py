@@ -0,0 +1,259 @@
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# methods the load can be mixed from
+BENCH_METHODS = ('GET', 'HEAD', 'PUT', 'POST')
+SIZE_UNITS = {'k': 1024, 'm': 1048576}
+
+def parse_size(label):
+	unit = SIZE_UNITS.get(label[-1].lower())
+	return int(label[ : -1]) * unit if unit else int(label)
+
+# 'GET:80,HEAD:10,PUT:10' -> [('GET', 80), ('HEAD', 10), ('PUT', 10)]
+def parse_mix(value):
+	mix = []
+	for item in value.split(','):
+		method, _, weight = item.partition(':')
+		method = method.strip().upper()
+		if method not in BENCH_METHODS:
+			raise argparse.ArgumentTypeError(f'method must be one of {", ".join(BENCH_METHODS)}')
+		mix.append((method, int(weight or 1)))
+	return mix
+
+def percentile(ordered, p):
+	if not ordered:
+		return None
+	return ordered[min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+# DocumentRoot set in httpserver.config, resolved like the server does
+def config_document_root():
+	with open('httpserver.config') as f:
+		for line in f:
+			items = line.split('#', 1)[0].split()
+			if len(items) == 2 and items[0] == 'DocumentRoot':
+				return items[1].strip('/')
+	return '.'
+
+
+# files of every benchmarked size under the document root, created once and reused across runs
+def prepare_fixtures(docroot, sizes):
+	directory = os.path.join(docroot, 'bench')
+	os.makedirs(directory, exist_ok = True)
+	os.makedirs(os.path.join(docroot, 'post_data'), exist_ok = True) # where POSTed forms are logged
+	uris = {}
+	for label in sizes:
+		size = parse_size(label)
+		path = os.path.join(directory, f'file_{label}.bin')
+		if not os.path.exists(path) or os.path.getsize(path) != size:
+			with open(path, 'wb') as f:
+				f.write(os.urandom(size))
+		uris[label] = f'/bench/file_{label}.bin'
+	return uris
+
+
+#one load-generating client connection: sends requests from the mix back to back until the
+#deadline and records (method, latency, ok, bytes) for each
+class Client(threading.Thread):
+	def __init__(self, index, args, uris, put_body, deadline, results):
+		super().__init__(daemon = True)
+		self.index = index
+		self.args = args
+		self.uris = uris
+		self.put_body = put_body
+		self.deadline = deadline
+		self.results = results
+		self.methods = [method for method, weight in args.mix]
+		self.weights = [weight for method, weight in args.mix]
+		self.conn = None
+
+	def request(self, method):
+		headers = {} if self.args.keep_alive else {'Connection': 'close'}
+		body = None
+		if method in ('GET', 'HEAD'):
+			uri = random.choice(list(self.uris.values()))
+		elif method == 'PUT':
+			uri = f'/bench/put_{os.getpid()}_{self.index}.txt'
+			headers['Content-Type'] = 'text/plain'
+			body = self.put_body
+		else:
+			uri = '/form.html'
+			headers['Content-Type'] = 'application/x-www-form-urlencoded'
+			body = b'fname=bench&lname=client'
+
+		if self.conn is None:
+			self.conn = http.client.HTTPConnection(self.args.host, self.args.port, timeout = self.args.timeout)
+		self.conn.request(method, uri, body = body, headers = headers)
+		response = self.conn.getresponse()
+		data = response.read()
+		if response.will_close:
+			self.conn.close()
+			self.conn = None
+		return response.status, len(data)
+
+	def run(self):
+		results = []
+		while time.monotonic() < self.deadline:
+			method = random.choices(self.methods, self.weights)[0]
+			start = time.perf_counter()
+			try:
+				status, size = self.request(method)
+				ok = status < 400
+			except (OSError, http.client.HTTPException):
+				if self.conn is not None:
+					self.conn.close()
+					self.conn = None
+				status, size, ok = None, 0, False
+			results.append((method, time.perf_counter() - start, ok, size))
+		if self.conn is not None:
+			self.conn.close()
+		self.results.extend(results)
+
+
+# one load-generating process running its share of the client connections
+def client_process(args, uris, put_body, clients, deadline, queue):
+	results = []
+	threads = [Client(i, args, uris, put_body, deadline, results) for i in range(clients)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	queue.put(results)
+
+
+def summarize(samples, elapsed):
+	latencies = sorted(latency for method, latency, ok, size in samples)
+	errors = sum(1 for method, latency, ok, size in samples if not ok)
+	ms = lambda value: None if value is None else round(value * 1000, 3)
+	return {
+		'requests': len(samples),
+		'errors': errors,
+		'rps': round(len(samples) / elapsed, 1) if elapsed else 0,
+		'bytes': sum(size for method, latency, ok, size in samples),
+		'latency_ms': {
+			'p50': ms(percentile(latencies, 50)),
+			'p95': ms(percentile(latencies, 95)),
+			'p99': ms(percentile(latencies, 99)),
+			'max': ms(latencies[-1] if latencies else None)
+		}
+	}
+
+
+def wait_for_port(host, port, timeout):
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		try:
+			socket.create_connection((host, port), timeout = 1).close()
+			return True
+		except OSError:
+			time.sleep(0.1)
+	return False
+
+
+def start_server(args):
+	code = f'from HTTP_server import HTTPServer\ns = HTTPServer()\ns.port = {args.port}\ns.start()'
+	server = subprocess.Popen([sys.executable, '-c', code], cwd = os.path.dirname(os.path.abspath(__file__)),
+		stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+	if not wait_for_port(args.host, args.port, 10):
+		server.kill()
+		sys.exit(f'Server did not start listening on port {args.port}')
+	return server
+
+
+def git_revision():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+			cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+	except OSError:
+		return None
+
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Load-test the HTTP server and report throughput and latency')
+	parser.add_argument('--host', default = '127.0.0.1')
+	parser.add_argument('--port', type = int, default = 12000)
+	parser.add_argument('--external', action = 'store_true', help = 'benchmark an already running server instead of starting one')
+	parser.add_argument('--docroot', help = 'DocumentRoot of the server (default: the one in httpserver.config), fixtures are written under bench/ in it')
+	parser.add_argument('--duration', type = float, default = 10, help = 'seconds to run')
+	parser.add_argument('--concurrency', type = int, default = 16, help = 'client connections')
+	parser.add_argument('--processes', type = int, default = max(1, min(4, (os.cpu_count() or 2) // 2)),
+		help = 'client processes the connections are spread over')
+	parser.add_argument('--no-keep-alive', dest = 'keep_alive', action = 'store_false', help = 'one connection per request')
+	parser.add_argument('--mix', type = parse_mix, default = parse_mix('GET:90,HEAD:5,PUT:5'), help = 'method weights, e.g. GET:80,HEAD:10,PUT:5,POST:5')
+	parser.add_argument('--sizes', default = '1k,64k,1m', help = 'sizes of the static files requested by GET and HEAD')
+	parser.add_argument('--put-file', default = 'put_sample.txt', help = 'request body of the PUTs')
+	parser.add_argument('--timeout', type = float, default = 10, help = 'per-request socket timeout')
+	parser.add_argument('--json', help = 'write the results to this file, to compare runs across commits')
+	args = parser.parse_args()
+
+	os.chdir(os.path.dirname(os.path.abspath(__file__)))
+	if args.docroot is None:
+		args.docroot = config_document_root()
+	uris = prepare_fixtures(args.docroot, args.sizes.split(','))
+	with open(args.put_file, 'rb') as f:
+		put_body = f.read()
+
+	server = None if args.external else start_server(args)
+	try:
+		queue = multiprocessing.Queue()
+		processes = min(args.processes, args.concurrency)
+		start = time.monotonic()
+		deadline = start + args.duration
+		workers = []
+		for i in range(processes):
+			clients = args.concurrency // processes + (1 if i < args.concurrency % processes else 0)
+			worker = multiprocessing.Process(target = client_process, args = (args, uris, put_body, clients, deadline, queue))
+			worker.start()
+			workers.append(worker)
+		samples = []
+		for worker in workers:
+			samples += queue.get()
+		for worker in workers:
+			worker.join()
+		elapsed = time.monotonic() - start
+	finally:
+		if server is not None:
+			server.terminate()
+			server.wait(timeout = 40)
+		for name in os.listdir(os.path.join(args.docroot, 'bench')):
+			if name.startswith('put_'):
+				os.remove(os.path.join(args.docroot, 'bench', name))
+
+	methods = {}
+	for sample in samples:
+		methods.setdefault(sample[0], []).append(sample)
+	report = {
+		'revision': git_revision(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+		'config': {
+			'duration': args.duration,
+			'concurrency': args.concurrency,
+			'keep_alive': args.keep_alive,
+			'mix': dict(args.mix),
+			'sizes': args.sizes.split(',')
+		},
+		'total': summarize(samples, elapsed),
+		'methods': {method: summarize(method_samples, elapsed) for method, method_samples in sorted(methods.items())}
+	}
+
+	print(f"{'':8} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+	for name, result in [('total', report['total'])] + list(report['methods'].items()):
+		latency = result['latency_ms']
+		print(f"{name:8} {result['requests']:9} {result['errors']:7} {result['rps']:9} {latency['p50'] or 0:8} "
+			f"{latency['p95'] or 0:8} {latency['p99'] or 0:8}")
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(report, f, indent = 2)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,92 @@
+import socket
+import unittest
+from HTTP_reader import RequestReader, RequestError, body_framing
+
+# unit tests for request body framing and the chunked decoder: python -m unittest test_HTTP_reader
+
+def head(*fields):
+	return b'POST / HTTP/1.1\r\nHost: localhost\r\n' + b''.join(field + b'\r\n' for field in fields) + b'\r\n'
+
+
+class BodyFramingTest(unittest.TestCase):
+	def status(self, *fields):
+		with self.assertRaises(RequestError) as raised:
+			body_framing(head(*fields), 1000)
+		return raised.exception.status_code
+
+	def test_no_body(self):
+		self.assertEqual(body_framing(head(), 1000), (None, False, False))
+
+	def test_content_length(self):
+		self.assertEqual(body_framing(head(b'Content-Length: 10'), 1000), (10, False, False))
+		self.assertEqual(body_framing(head(b'Content-Length: 10', b'Content-Length: 10'), 1000), (10, False, False))
+		self.assertEqual(body_framing(head(b'Content-Length: 10, 10'), 1000), (10, False, False))
+
+	def test_invalid_content_length(self):
+		for value in (b'-1', b'+3', b'1_0', b'0x3', b'', b'3 3'):
+			self.assertEqual(self.status(b'Content-Length: ' + value), 400, value)
+
+	def test_conflicting_content_length(self):
+		self.assertEqual(self.status(b'Content-Length: 10', b'Content-Length: 11'), 400)
+		self.assertEqual(self.status(b'Content-Length: 10, 11'), 400)
+
+	def test_content_too_large(self):
+		self.assertEqual(self.status(b'Content-Length: 1001'), 413)
+
+	def test_chunked(self):
+		self.assertEqual(body_framing(head(b'Transfer-Encoding: chunked'), 1000), (None, True, False))
+		self.assertEqual(body_framing(head(b'Transfer-Encoding: Chunked', b'Expect: 100-continue'), 1000), (None, True, True))
+
+	def test_invalid_transfer_encoding(self):
+		self.assertEqual(self.status(b'Transfer-Encoding: gzip'), 400)
+		self.assertEqual(self.status(b'Transfer-Encoding: chunked, gzip'), 400)
+		self.assertEqual(self.status(b'Transfer-Encoding: chunked', b'Transfer-Encoding: chunked'), 400)
+		self.assertEqual(self.status(b'Transfer-Encoding: '), 400)
+		self.assertEqual(self.status(b'Transfer-Encoding: gzip, chunked'), 501)
+
+	def test_transfer_encoding_with_content_length(self):
+		self.assertEqual(self.status(b'Transfer-Encoding: chunked', b'Content-Length: 3'), 400)
+		self.assertEqual(self.status(b'Content-Length: 3', b'Transfer-Encoding: chunked'), 400)
+
+
+class ChunkedBodyTest(unittest.TestCase):
+	# the body a RequestReader decodes from data sent by the client, and what is left buffered
+	def decode(self, data, max_body_size = 1000):
+		client, server = socket.socketpair()
+		try:
+			client.sendall(head(b'Transfer-Encoding: chunked') + data)
+			client.shutdown(socket.SHUT_WR)
+			reader = RequestReader(server, max_body_size = max_body_size)
+			_, body = reader.read_request()
+			return body.read(), bytes(reader.buffer)
+		finally:
+			client.close()
+			server.close()
+
+	def status(self, data, max_body_size = 1000):
+		with self.assertRaises(RequestError) as raised:
+			self.decode(data, max_body_size)
+		return raised.exception.status_code
+
+	def test_chunks(self):
+		self.assertEqual(self.decode(b'3\r\nabc\r\nA\r\n0123456789\r\n0\r\n\r\n'), (b'abc0123456789', b''))
+
+	def test_extensions_and_trailers(self):
+		self.assertEqual(self.decode(b'3;name=value\r\nabc\r\n0\r\nTrailer: x\r\n\r\n'), (b'abc', b''))
+
+	def test_next_request_stays_buffered(self):
+		self.assertEqual(self.decode(b'3\r\nabc\r\n0\r\n\r\nGET / HTTP/1.1\r\n\r\n'), (b'abc', b'GET / HTTP/1.1\r\n\r\n'))
+
+	def test_malformed_chunk_size(self):
+		for size in (b'-1', b'+3', b'1_0', b'0x3', b'', b'g', b'3 3'):
+			self.assertEqual(self.status(size + b'\r\nabc\r\n0\r\n\r\n'), 400, size)
+
+	def test_chunk_longer_than_size(self):
+		self.assertEqual(self.status(b'3\r\nabcd\r\n0\r\n\r\n'), 400)
+
+	def test_content_too_large(self):
+		self.assertEqual(self.status(b'8\r\n01234567\r\n0\r\n\r\n', max_body_size = 4), 413)
+
+
+if __name__ == '__main__':
+	unittest.main()